@@ -1,26 +1,56 @@
 import gdspy
 import json
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List, Tuple, Optional
 from .poly_mapper import *
-from .nets_extractor import recursive_connect
+from .nets_extractor import recursive_connect, flatten_stack
 from .dev_extractor import * 
 from .pin_handler import *
+from ..progress import stage
+from .tiling import make_tiles, in_core, inside, layer_bboxes, select_layers, clip_layers, stitch_fragments
 
 # ===============================================================
 # CDL writer
 # ===============================================================
 
+def format_cdl(device, W, L, ports, cellname, instances = None):
+	instances = instances or []
+	ports = list(dict.fromkeys([label.text for label in ports]))
+	ports = " ".join(ports)
+	text = f".SUBCKT {cellname} {ports}\n"
+	for i, ((drn_net, gate_net, src_net, bulk_net, model), nfinger) in enumerate(device.items(), 1):
+		key = (drn_net, gate_net, src_net, bulk_net, model)
+		name = f"M{i}"
+		text += f"{name} {drn_net} {gate_net} {src_net} {bulk_net} {model} W={W[key]}u L={L[key]}u nf={nfinger}\n"
+	for name, subckt, nets in instances:
+		text += f"{name} {' '.join(nets)} {subckt}\n"
+	text += f".ends {cellname}"
+	return text
+
+#----------------------------------------------------------------	
+
+def to_netlist(device, W, L, ports, cellname, instances = None):
+	"""
+	Returns the subcircuit in the structure of parser.parse_netlist,
+	i.e. what parsing the text of format_cdl gives
+	"""
+	instances = instances or []
+	devices = []
+	for i, ((drn_net, gate_net, src_net, bulk_net, model), nfinger) in enumerate(device.items(), 1):
+		key = (drn_net, gate_net, src_net, bulk_net, model)
+		params = {"W": f"{W[key]}u", "L": f"{L[key]}u", "nf": f"{nfinger}"}
+		devices.append({"inst": f"M{i}", "type": "M", "nets": [drn_net, gate_net, src_net, bulk_net], "model": model, "params": params, "size": (float(L[key]), float(W[key]))})
+	for name, subckt, nets in instances:
+		devices.append({"inst": name, "type": name[0].upper(), "nets": list(nets), "model": subckt, "params": {}})
+	
+	ports = list(dict.fromkeys([label.text for label in ports]))
+	return {"name": cellname, "ports": ports, "devices": devices}
+
+#----------------------------------------------------------------	
+
 def write_cdl(device, W, L, ports, cellname, outfile="output.cdl"):
 	with open(outfile, "w") as f:
-		ports = list(dict.fromkeys([label.text for label in ports]))
-		ports = " ".join(ports)
-		f.write(f".SUBCKT {cellname} {ports}\n")
-		for i, ((drn_net, gate_net, src_net, bulk_net, model), nfinger) in enumerate(device.items(), 1):
-			key = (drn_net, gate_net, src_net, bulk_net, model)
-			name = f"M{i}"
-			line = f"{name} {drn_net} {gate_net} {src_net} {bulk_net} {model} W={W[key]}u L={L[key]}u nf={nfinger}\n"
-			f.write(line)
-		f.write(f".ends {cellname}")
+		f.write(format_cdl(device, W, L, ports, cellname))
 			
 # ===============================================================
 # File Readers
@@ -63,7 +93,22 @@ def read_config(file_path: str, layermap):
 		pin_info[tuple(item["pin"])] = tuple(item["metal"])
 		
 	return layermap,stack,pin_info
-	
+
+#----------------------------------------------------------------
+
+def read_tiling(file_path: str):
+	"""
+	Reads the optional "tiling" section of the config.
+
+	Returns:
+		tile_size (0 disables tiling), halo, workers (0 uses all cores)
+	"""
+	with open(file_path, "r") as config_file:
+		config = json.load(config_file)
+
+	tiling = config.get("tiling", {})
+	return tiling.get("tile_size", 0), tiling.get("halo", 2.0), tiling.get("workers", 0)
+
 #----------------------------------------------------------------	
 
 def get_polygons(cell):
@@ -86,14 +131,19 @@ def get_labels(cell):
 	return labels
 		
 		
+def read_library(layout):
+	"""Reads the layout and returns the gdspy.GdsLibrary and its dbu"""
+	lib = gdspy.GdsLibrary(infile=layout)
+	dbu = lib.precision/lib.unit
+	return lib, dbu
+	
+	
 def read_layout(layout, cellname):
 	"""
 	Reads the layout and returns a dictionary with 
 	key as (lay, dtype) and value as a list of gdspy.Polygon ids
 	"""
-	lib = gdspy.GdsLibrary(infile=layout)
-
-	dbu = lib.precision/lib.unit
+	lib, dbu = read_library(layout)
 	
 	#cell = lib.top_level()[0]
 	cell = lib.cells[cellname]
@@ -109,62 +159,487 @@ def read_layout(layout, cellname):
 	return cell, polygons, labels, dbu, lib
 	
 # ===============================================================
-# Main Function
+# Hierarchy
 # ===============================================================	
 
-def layout_to_cdl(gds_file, cellname, out_cdl, layermap, config_file):
+def hierarchy_order(cell):
+	"""Returns the unique cells of the hierarchy under cell, children first"""
+	order = []
+	seen = set()
+	
+	def visit(c):
+		seen.add(c.name)
+		for ref in c.references:
+			if isinstance(ref.ref_cell, gdspy.Cell) and ref.ref_cell.name not in seen:
+				visit(ref.ref_cell)
+		order.append(c)
+		
+	visit(cell)
+	return order
+	
+#----------------------------------------------------------------	
+
+def own_geometry(cell):
 	"""
-	Entry point: extract devices from layout and generate CDL.
+	Returns a working copy of the cell with its own polygons, 
+	paths (as polygons) and labels, without references
 	"""
+	own = gdspy.Cell(cell.name, exclude_from_current=True)
+	own.polygons = list(cell.polygons)
+	for path in cell.paths:
+		own.add(path.to_polygonset())
+	own.labels = list(cell.labels)
+	return own
 	
-	top_cell, polygons, labels, dbu, lib = read_layout(gds_file, cellname) 
-	#print(top_cell.name)
-	layer_keys = read_layermap(layermap)
-	layer_keys, stack, pin_info = read_config(config_file, layer_keys)
+#----------------------------------------------------------------	
+
+def placements(ref):
+	"""Returns the offsets of every placement of a CellReference or CellArray"""
+	if isinstance(ref, gdspy.CellArray):
+		return [(ref.spacing[0] * ii, ref.spacing[1] * jj) for ii in range(ref.columns) for jj in range(ref.rows)]
+	return [(0, 0)]
 	
-	top_cell = polygon_oring(top_cell, polygons, stack, dbu)
-	polygons = get_polygons(top_cell)
-	flag, top_cell, error = base_layer_ops(top_cell, polygons, layer_keys, dbu)
+#----------------------------------------------------------------	
 
-	if flag == True: 
-		polygons = get_polygons(top_cell)
-		# lib.write_gds("temp.gds")
+def place_subckt(cell, ref, spacing, subckt):
+	"""
+	Flattens the pin shapes of an extracted subcircuit into cell at 
+	one placement of ref (the interaction region at the instance boundary)
+	
+	Returns:
+		list: [(port, position, metal)] pin labels in cell coordinates
+	"""
+	for metal, pts in subckt["pin_shapes"]:
+		cell.add(gdspy.Polygon(transform_points(pts, ref, spacing), layer = metal[0], datatype = metal[1]))
+		
+	pins = []
+	for port, position, metal in subckt["pin_labels"]:
+		pins.append((port, transform_points([position], ref, spacing)[0], metal))
+	return pins
+	
+# ===============================================================
+# Extraction
+# ===============================================================	
+
+def connect_cell(cell, polygons, labels, layer_keys, stack, pin_info, dbu, allow_empty = False, strict = True):
+	"""
+	Runs layer merging, base layer ops and connectivity on a cell.
+	
+	Args:
+		allow_empty: a cell without devices of its own is not an error
+		strict: passed to base_layer_ops
+	
+	Returns:
+		flag, error, polygons, netmap, ports, GeometryStore
+	"""
+	with stage("layer merge"):
+		cell = polygon_oring(cell, polygons, stack, dbu)
+		polygons = get_polygons(cell)
 		
+	with stage("base layer ops"):
+		flag, cell, error = base_layer_ops(cell, polygons, layer_keys, dbu, strict)
+	
+	if flag == False and error == NO_DEVICE and allow_empty:
+		flag, error = True, ""
+
+	if flag == False:
+		return flag, error, {}, {}, [], None
+		
+	polygons = get_polygons(cell)
+	# lib.write_gds("temp.gds")
+	
+	with stage("connectivity"):
+		store = GeometryStore(dbu)
 		uf = UnionFind()
 		netmap = {}
 		for pin, metal in pin_info.items():
 			if pin in labels.keys() and metal in polygons.keys():
-				netmap = map_labels_to_polygons(uf, labels[pin], polygons[metal], netmap, dbu)
+				netmap = map_labels_to_polygons(uf, labels[pin], polygons[metal], netmap, store)
 		
 		ports = get_ports(pin_info, labels)
 		netmap = assign_ids(uf, polygons, netmap, 1)
-		netmap = recursive_connect(uf, stack, polygons, netmap, layer_keys[("poly", "drawing")], ports)
-			
-		poly_stack = [[(1002,0),(1003,0)], layer_keys[("poly", "drawing")]]
-		netmap = recursive_connect(uf, poly_stack, polygons, netmap, layer_keys[("poly", "drawing")], ports)
+		
+		poly = layer_keys[("poly", "drawing")]
+		if poly in polygons:
+			netmap = recursive_connect(uf, stack, polygons, netmap, poly, ports)
+				
+			poly_stack = [[(1002,0),(1003,0)], poly]
+			netmap = recursive_connect(uf, poly_stack, polygons, netmap, poly, ports)
+		else:
+			start = [layer for layer in flatten_stack(stack) if layer in polygons]
+			if start:
+				netmap = recursive_connect(uf, stack, polygons, netmap, start[0], ports)
 		
 		final_netmap = update_nets(netmap, uf.parent)
+	
+	return flag, error, polygons, final_netmap, ports, store
+	
+#----------------------------------------------------------------	
+
+def extract_cell(cell, polygons, labels, layer_keys, stack, pin_info, dbu, instances = None, allow_empty = False):
+	"""
+	Runs layer merging, base layer ops, connectivity and device recognition on a cell.
+	
+	Args:
+		cell: gdspy.Cell without references
+		instances: list of (inst_name, subckt, pins) placed in the cell, where subckt
+			is the result of extract_cell for the child and pins are the 
+			placed pin labels returned by place_subckt
+		allow_empty: a cell without devices is not an error (child cells 
+			such as fillers, taps or vias)
+	
+	Returns:
+		flag, error, dict: {devices, W, L, ports, supply, instances, pin_labels, pin_shapes}
+	"""
+	instances = instances or []
+	# A cell built only from instances has no devices of its own
+	flag, error, polygons, final_netmap, ports, store = connect_cell(cell, polygons, labels, layer_keys, stack, pin_info, dbu, allow_empty or len(instances) > 0)
+	if flag == False:
+		return flag, error, {}
+	
+	with stage("device recognition"):
+		diff = polygons.get(layer_keys[("diff", "drawing")], [])
+		devmap1 = find_edge_sharing(polygons.get((1002, 0), []), diff, store)
+		devmap2 = find_edge_sharing(polygons.get((1003, 0), []), diff, store)
+		
+		supply = get_supply(polygons, layer_keys, final_netmap, store)
+		
+		pmos, wp, lp = find_properties(final_netmap, devmap1, "PMOS", supply, store)
+		nmos, wn, ln = find_properties(final_netmap, devmap2, "NMOS", supply, store)
+	
+	for k, v in pmos.items():
+		nmos[k] = v
+	for k, v in wp.items():
+		wn[k] = v
+	for k, v in lp.items():
+		ln[k] = v
+		
+	placed = []
+	covering = iter(locate_pins([pin for _, _, pins in instances for pin in pins], polygons, store))
+	for name, subckt, pins in instances:
+		nets = {}
+		for port, position, metal in pins:
+			nets.setdefault(port, final_netmap.get(next(covering), "UNCONNECTED"))
+		placed.append((name, subckt["name"], [nets.get(port, "UNCONNECTED") for port in subckt["port_names"]]))
+	
+	# Pin labels and the shapes under them, handed to the parent cells
+	port_labels = ports[0] if ports else []
+	pin_layer = [lay for lay in pin_info.keys() if lay in labels]
+	pin_labels = []
+	pin_shapes = []
+	if pin_layer:
+		metal = pin_info[pin_layer[0]]
+		pin_labels = [(label.text, label.position, metal) for label in port_labels]
+		for p in dict.fromkeys(locate_pins(pin_labels, polygons, store)):
+			if p is not None:
+				pin_shapes.append((metal, p.polygons[0]))
+	store.clear()
+	
+	return flag, error, {
+		"name": cell.name,
+		"devices": nmos,
+		"W": wn,
+		"L": ln,
+		"ports": ports,
+		"port_names": list(dict.fromkeys([label.text for label in port_labels])),
+		"supply": supply,
+		"instances": placed,
+		"pin_labels": pin_labels,
+		"pin_shapes": pin_shapes
+	}
+	
+#----------------------------------------------------------------	
+
+def extract_hierarchy(lib, cellname, layer_keys, stack, pin_info, dbu):
+	"""
+	Extracts every unique cell under cellname once, children first.
+	Child instances are kept as X instances; only their pin shapes are 
+	flattened into the parent to resolve the nets at instance boundaries.
+	Child cells without devices in their hierarchy (fillers, taps, vias)
+	are flattened into the parent, as in the flat mode.
+	
+	Returns:
+		flag, error, list of extract_cell results (children first)
+	"""
+	subckts = {}
+	flat = set()
+	for cell in hierarchy_order(lib.cells[cellname]):
+		own = own_geometry(cell)
+		instances = []
+		for ref in cell.references:
+			if not isinstance(ref.ref_cell, gdspy.Cell):
+				continue
+			if ref.ref_cell.name in flat:
+				for layer, polys in ref.get_polygons(by_spec = True).items():
+					for pts in polys:
+						own.add(gdspy.Polygon(pts, layer = layer[0], datatype = layer[1]))
+				continue
+			subckt = subckts[ref.ref_cell.name]
+			for spacing in placements(ref):
+				pins = place_subckt(own, ref, spacing, subckt)
+				instances.append((f"X{len(instances) + 1}", subckt, pins))
+		
+		# Only the requested cell must hold devices, children may be fillers, taps or vias
+		flag, error, result = extract_cell(own, get_polygons(own), get_labels(own), layer_keys, stack, pin_info, dbu, instances, cell.name != cellname)
+		if flag == False:
+			return flag, f"{cell.name}: {error}", []
+		if cell.name != cellname and not result["devices"] and not result["instances"]:
+			flat.add(cell.name)
+		else:
+			subckts[cell.name] = result
 		
-		devmap1 = find_edge_sharing(polygons[(1002, 0)], polygons[layer_keys[("diff", "drawing")]], dbu)
-		devmap2 = find_edge_sharing(polygons[(1003, 0)], polygons[layer_keys[("diff", "drawing")]], dbu)
+	return True, "", list(subckts.values())
+	
+# ===============================================================
+# Tiled Extraction
+# ===============================================================	
+
+def owned_devices(selected, core, window, layer_keys, stack, polygons, netmap, store, dbu):
+	"""
+	Device records of the gates owned by a tile, i.e. whose bounding box has 
+	its lower left corner in the core. The gates are measured on the unclipped 
+	device layers, so that a gate crossing the tile border is reported once
+	and whole, and take the nets of the clipped gate piece overlapping them.
+	
+	Returns:
+		{model: [(gate_net, src_net, drn_net, length, area)]}
+	"""
+	keys = [layer_keys[(name, "drawing")] for name in ("diff", "poly", "pp", "np")]
+	cell = clip_layers({layer: [(pts, False) for pts, _ in selected[layer]] for layer in keys if layer in selected}, window, dbu)
+	cell = polygon_oring(cell, get_polygons(cell), stack, dbu)
+	_, cell, _ = base_layer_ops(cell, get_polygons(cell), layer_keys, dbu, False)
+	full = get_polygons(cell)
+	
+	diff = full.get(layer_keys[("diff", "drawing")], [])
+	clipped_diff = polygons.get(layer_keys[("diff", "drawing")], [])
+	records = {}
+	for layer, model in (((1002, 0), "PMOS"), ((1003, 0), "NMOS")):
+		gates = [gate for gate in full.get(layer, []) if in_core(gate.get_bounding_box()[0], core)]
+		pieces = {p: t for p, t in find_edge_sharing(polygons.get(layer, []), clipped_diff, store).items() if len(t) == 2}
+		candidates = list(pieces)
+		tree = STRtree([store.shape(p) for p in candidates])
 		
-		supply = get_supply(polygons, layer_keys, final_netmap)
+		records[model] = []
+		for gate, terminals in find_edge_sharing(gates, diff, store).items():
+			if len(terminals) != 2:
+				continue
+			
+			nets = ("UNCONNECTED", "UNCONNECTED", "UNCONNECTED")
+			for idx in sorted(tree.query(store.shape(gate))):
+				piece = candidates[idx]
+				if store.overlap(piece, gate):
+					source, drain = pieces[piece]
+					nets = tuple(netmap.get(p, "UNCONNECTED") for p in (piece, source, drain))
+					break
+			records[model].append((*nets, cal_length(*terminals, store, 0), cal_area(gate, store)))
+			
+	return records
+	
+#----------------------------------------------------------------	
+
+def extract_tile(task):
+	"""
+	Extracts one tile of a large flat cell (runs in a worker process).
+	Only the gates owned by the tile are reported (see owned_devices).
+	Nets are not named after labels here: the labels of the core are 
+	reported with their covering polygon and named by extract_tiled.
+	
+	Returns:
+		flag, error, dict: {records, supply, label_nets, fragments} with tile local net names, 
+			where fragments are the shapes reaching the window of another tile and 
+			label_nets are (label index, text, net, covering polygon) with the polygon
+			as ("fragment", index in fragments) or ("polygon", id in the tile)
+	"""
+	tile, (core, window, inner), selected, tile_labels, layer_keys, stack, pin_info, dbu = task
+	
+	cell = clip_layers(selected, window, dbu)
+	flag, error, polygons, netmap, ports, store = connect_cell(cell, get_polygons(cell), {}, layer_keys, stack, pin_info, dbu, True, False)
+	if flag == False:
+		return flag, error, {}
 		
-		pmos, wp, lp = find_properties(final_netmap, devmap1, "PMOS", supply, dbu)
-		nmos, wn, ln = find_properties(final_netmap, devmap2, "NMOS", supply, dbu)
+	records = owned_devices(selected, core, window, layer_keys, stack, polygons, netmap, store, dbu)
+	supply = get_supply(polygons, layer_keys, netmap, store)
+	
+	fragments = []
+	fragment_of = {}
+	for layer, polys in polygons.items():
+		for p in polys:
+			if not inside(p.get_bounding_box(), inner):
+				fragment_of[p] = len(fragments)
+				fragments.append((layer, p.polygons[0], netmap[p]))
+	
+	pins = [(text, position, pin_info[layer]) for _, text, position, layer in tile_labels]
+	label_nets = []
+	local = {}
+	for (index, text, _, _), p in zip(tile_labels, locate_pins(pins, polygons, store)):
+		if p is not None:
+			polygon = ("fragment", fragment_of[p]) if p in fragment_of else ("polygon", local.setdefault(p, len(local)))
+			label_nets.append((index, text, netmap[p], polygon))
+	store.clear()
+	
+	return flag, error, {
+		"records": records,
+		"supply": supply,
+		"label_nets": label_nets,
+		"fragments": fragments
+	}
+	
+#----------------------------------------------------------------	
+
+def extract_tiled(cell, polygons, labels, tiles, layer_keys, stack, pin_info, dbu, workers = 0):
+	"""
+	Extracts a flat cell tile by tile in a process pool and stitches 
+	the nets of the tiles through the fragments overlapping in the halos.
+	
+	Returns:
+		flag, error, dict: {name, devices, W, L, ports, supply}
+	"""
+	layers = {layer: [pts for p in polys for pts in p.polygons] for layer, polys in polygons.items()}
+	bboxes = layer_bboxes(layers)
+	# Pin labels in the order of the flat extraction, each handled by the tile owning its position
+	pin_labels = [(index, label.text, tuple(label.position), layer) for index, (layer, label) in enumerate((layer, label) for layer, lbls in labels.items() if layer in pin_info for label in lbls)]
+	
+	tasks = []
+	for tile, (core, window, inner) in enumerate(tiles):
+		selected = select_layers(layers, bboxes, window)
+		if selected:
+			tile_labels = [l for l in pin_labels if in_core(l[2], core)]
+			tasks.append((tile, tiles[tile], selected, tile_labels, layer_keys, stack, pin_info, dbu))
+	
+	with stage("tiled extraction"), ProcessPoolExecutor(max_workers = workers or None) as pool:
+		results = list(pool.map(extract_tile, tasks))
+	
+	# Nets are keyed by (tile, net) and labels by ("label", text)
+	uf = UnionFind()
+	fragments = []
+	labelled = []
+	supply = {}
+	records = {"PMOS": [], "NMOS": []}
+	for task, (flag, error, result) in zip(tasks, results):
+		if flag == False:
+			return flag, error, {}
+		tile = task[0]
+		offset = len(fragments)
 		
-		for k, v in pmos.items():
-			nmos[k] = v
-		for k, v in wp.items():
-			wn[k] = v
-		for k, v in lp.items():
-			ln[k] = v
+		def key(net):
+			return net if net == "UNCONNECTED" else (tile, net)
 			
-		write_cdl(nmos, wn, ln, ports[0], top_cell.name, out_cdl)
+		for layer, pts, net in result["fragments"]:
+			fragments.append((layer, pts, key(net), tile))
+		for index, text, net, (kind, n) in result["label_nets"]:
+			labelled.append((index, text, key(net), offset + n if kind == "fragment" else (tile, n)))
+		for model, net in result["supply"].items():
+			supply[model] = key(net)
+		for model, recs in result["records"].items():
+			records[model].extend([(key(g), key(s), key(d), length, area) for g, s, d, length, area in recs])
+	
+	stitch_fragments(uf, fragments)
+	
+	# As in the flat extraction a polygon takes the first label covering it. 
+	# The fragments of a polygon are joined the way their nets are
+	metals = set(pin_info.values())
+	shapes = UnionFind()
+	stitch_fragments(shapes, [(layer, pts, n, tile) for n, (layer, pts, _, tile) in enumerate(fragments) if layer in metals])
+	first = {}
+	for index, text, net, polygon in sorted(labelled, key = lambda l: l[0]):
+		first.setdefault(shapes.find(polygon), (text, net))
+	for text, net in first.values():
+		uf.union(net, ("label", text))
+	
+	# A net takes the name of its label, others are numbered
+	names = {}
+	for text in sorted({text for text, net in first.values()}):
+		names.setdefault(uf.find(("label", text)), text)
+		
+	def name(net):
+		if net == "UNCONNECTED":
+			return net
+		return names.setdefault(uf.find(net), f"net{len(names) + 1}")
+		
+	supply = {model: name(net) for model, net in supply.items()}
+	
+	if not records["PMOS"] or not records["NMOS"]:
+		return False, NO_DEVICE, {}
+	if "PMOS" not in supply or "NMOS" not in supply:
+		return False, FLOATING_DEVICE, {}
+	
+	devices, W, L = {}, {}, {}
+	for model in ("NMOS", "PMOS"):
+		recs = [(name(g), name(s), name(d), length, area) for g, s, d, length, area in records[model]]
+		nfinger, width, length = aggregate_devices(recs, model, supply, dbu)
+		devices.update(nfinger)
+		W.update(width)
+		L.update(length)
 		
-		return flag, error, list(supply.values())
+	return True, "", {
+		"name": cell.name,
+		"devices": devices,
+		"W": W,
+		"L": L,
+		"ports": get_ports(pin_info, labels),
+		"supply": supply
+	}
+	
+# ===============================================================
+# Main Function
+# ===============================================================	
+
+def layout_to_cdl(gds_file, cellname, out_cdl, layermap, config_file, hierarchical = False):
+	"""
+	Entry point: extract devices from layout and generate CDL.
+	
+	With hierarchical = True the cell is not flattened: each unique child 
+	cell is written once as its own .SUBCKT and placed with X instances.
+	
+	A flat cell larger than the tile_size of the config is extracted 
+	tile by tile on all cores.
+	
+	The CDL is only written when out_cdl is given.
+	
+	Returns:
+		flag, error, supply nets, netlist as returned by parser.parse_netlist
+	"""
+	layer_keys = read_layermap(layermap)
+	layer_keys, stack, pin_info = read_config(config_file, layer_keys)
+	
+	if hierarchical:
+		lib, dbu = read_library(gds_file)
+		flag, error, subckts = extract_hierarchy(lib, cellname, layer_keys, stack, pin_info, dbu)
+		if flag == False:
+			return flag, error, [], {}
+			
+		text = []
+		supply = []
+		netlist = {}
+		for sub in subckts:
+			ports = sub["ports"][0] if sub["ports"] else []
+			netlist[sub["name"]] = to_netlist(sub["devices"], sub["W"], sub["L"], ports, sub["name"], sub["instances"])
+			text.append(format_cdl(sub["devices"], sub["W"], sub["L"], ports, sub["name"], sub["instances"]))
+			supply.extend(sub["supply"].values())
+			
+		if out_cdl is not None:
+			with open(out_cdl, "w") as f:
+				f.write("\n\n".join(text))
+			
+		return flag, error, list(dict.fromkeys(supply)), netlist
+	
+	top_cell, polygons, labels, dbu, lib = read_layout(gds_file, cellname) 
+	#print(top_cell.name)
+	tile_size, halo, workers = read_tiling(config_file)
+	tiles = make_tiles(top_cell.get_bounding_box(), tile_size, halo) if tile_size > 0 else []
+	
+	if len(tiles) > 1:
+		flag, error, result = extract_tiled(top_cell, polygons, labels, tiles, layer_keys, stack, pin_info, dbu, workers)
+	else:
+		flag, error, result = extract_cell(top_cell, polygons, labels, layer_keys, stack, pin_info, dbu)
+
+	if flag == True: 
+		netlist = {top_cell.name: to_netlist(result["devices"], result["W"], result["L"], result["ports"][0], top_cell.name)}
+		if out_cdl is not None:
+			write_cdl(result["devices"], result["W"], result["L"], result["ports"][0], top_cell.name, out_cdl)
+		return flag, error, list(result["supply"].values()), netlist
 	
 	else:
-		return flag, error, []
+		return flag, error, [], {}
 
 #layout_to_cdl("/home/linuxmint/Desktop_content/LVS_tool/10t_5cells.gds", "./dummy_cdl", "./layermap_SCL.json", "./config.json")
@@ -1,8 +1,8 @@
 from shapely.geometry import Point
-from .geometry_utils import gdspy_to_shapely
+from shapely.strtree import STRtree
 
 
-def map_labels_to_polygons(uf, labels, polygons, netmap, dbu):
+def map_labels_to_polygons(uf, labels, polygons, netmap, store):
 	"""
 	Checks if a pin lies inside a polygon
 	and maps polygon to label name
@@ -10,13 +10,14 @@ def map_labels_to_polygons(uf, labels, polygons, netmap, dbu):
 	Args:
 		labels (list): list of gdspy.Label
 		polygons (list): list of gdspy.Polygon
+		store (GeometryStore): per-run geometry cache
 	
 	Returns:
 		dict: {gdspy.Polygon: label.text}
 	"""
 
 	for poly in polygons:
-		shapely_poly = gdspy_to_shapely(poly, dbu)
+		shapely_poly = store.shape(poly)
 
 		for label in labels:
 			point = Point(label.position)
@@ -29,6 +30,28 @@ def map_labels_to_polygons(uf, labels, polygons, netmap, dbu):
 	return netmap
 
 #----------------------------------------------------------------	
+
+def locate_pins(pins, polygons, store):
+	"""
+	Finds the polygon covering each pin position
+	
+	Args:
+		pins (list): list of (port, position, metal)
+		polygons (dict): {(lay, dtype): [gdspy.Polygon]}
+	
+	Returns:
+		list: covering gdspy.Polygon (first in layer order) or None, per pin
+	"""
+	trees = {}
+	found = []
+	for port, position, metal in pins:
+		if metal not in trees:
+			trees[metal] = STRtree([store.shape(p) for p in polygons.get(metal, [])])
+		idx = trees[metal].query(Point(position), predicate = "covered_by")
+		found.append(polygons[metal][min(idx)] if len(idx) > 0 else None)
+	return found
+
+#----------------------------------------------------------------	
 	
 def get_ports(pin_info, labels):
 	ports = []
@@ -0,0 +1,139 @@
+import math
+import gdspy
+import numpy
+from collections import defaultdict
+from shapely import touches
+from shapely.geometry import Polygon
+from shapely.strtree import STRtree
+from .geometry_utils import boolean_and
+
+# ===============================================================
+# Tiles
+# ===============================================================
+
+INF = float("inf")
+
+#----------------------------------------------------------------
+
+def make_tiles(bbox, tile_size, halo):
+	"""
+	Partitions a bounding box into square tiles.
+
+	Every tile has:
+		core: the region owned by the tile (outer edges extended to infinity)
+		window: the core grown by halo, the geometry seen by the tile
+		inner: the core shrunk by halo, shapes inside it never reach another window
+
+	Returns:
+		list of (core, window, inner) as (x0, y0, x1, y1)
+	"""
+	(x0, y0), (x1, y1) = bbox
+	nx = max(1, math.ceil((x1 - x0) / tile_size))
+	ny = max(1, math.ceil((y1 - y0) / tile_size))
+	xs = [x0 + i * tile_size for i in range(nx)] + [x1]
+	ys = [y0 + j * tile_size for j in range(ny)] + [y1]
+
+	tiles = []
+	for i in range(nx):
+		for j in range(ny):
+			window = (xs[i] - halo, ys[j] - halo, xs[i + 1] + halo, ys[j + 1] + halo)
+			core = (xs[i] if i > 0 else -INF,
+					ys[j] if j > 0 else -INF,
+					xs[i + 1] if i < nx - 1 else INF,
+					ys[j + 1] if j < ny - 1 else INF)
+			inner = (core[0] + halo, core[1] + halo, core[2] - halo, core[3] - halo)
+			tiles.append((core, window, inner))
+	return tiles
+
+#----------------------------------------------------------------
+
+def in_core(point, core):
+	"""Half open test, so that every point is owned by exactly one tile"""
+	return core[0] <= point[0] < core[2] and core[1] <= point[1] < core[3]
+
+#----------------------------------------------------------------
+
+def inside(bbox, box):
+	"""Checks if bbox ((x0, y0), (x1, y1)) lies inside box (x0, y0, x1, y1)"""
+	return box[0] <= bbox[0][0] and box[1] <= bbox[0][1] and bbox[1][0] <= box[2] and bbox[1][1] <= box[3]
+
+# ===============================================================
+# Geometry per Tile
+# ===============================================================
+
+def layer_bboxes(layers):
+	"""Returns the bounding boxes of {layer: [points]} as {layer: numpy (n, 4)}"""
+	bboxes = {}
+	for layer, shapes in layers.items():
+		bboxes[layer] = numpy.array([[*pts.min(axis = 0), *pts.max(axis = 0)] for pts in shapes]).reshape(-1, 4)
+	return bboxes
+
+#----------------------------------------------------------------
+
+def select_layers(layers, bboxes, window):
+	"""
+	Returns the shapes of {layer: [points]} touching the window,
+	with a flag telling if the shape needs clipping
+	"""
+	selected = {}
+	for layer, shapes in layers.items():
+		bb = bboxes[layer]
+		hit = (bb[:, 0] <= window[2]) & (bb[:, 2] >= window[0]) & (bb[:, 1] <= window[3]) & (bb[:, 3] >= window[1])
+		within = (bb[:, 0] >= window[0]) & (bb[:, 2] <= window[2]) & (bb[:, 1] >= window[1]) & (bb[:, 3] <= window[3])
+		idx = numpy.nonzero(hit)[0]
+		if len(idx) > 0:
+			selected[layer] = [(shapes[i], not within[i]) for i in idx]
+	return selected
+
+#----------------------------------------------------------------
+
+def clip_layers(selected, window, dbu):
+	"""
+	Builds a cell from the selected shapes. Shapes crossing the
+	window border are clipped to the window.
+	"""
+	cell = gdspy.Cell("TILE", exclude_from_current = True)
+	rect = gdspy.Rectangle(window[:2], window[2:])
+	for layer, shapes in selected.items():
+		crossing = []
+		for pts, clip in shapes:
+			if clip:
+				crossing.append(pts)
+			else:
+				cell.add(gdspy.Polygon(pts, layer = layer[0], datatype = layer[1]))
+
+		clipped = boolean_and(crossing, rect, dbu, layer) if crossing else None
+		if clipped is not None:
+			for pts in clipped.polygons:
+				cell.add(gdspy.Polygon(pts, layer = layer[0], datatype = layer[1]))
+	return cell
+
+# ===============================================================
+# Stitching
+# ===============================================================
+
+def stitch_fragments(uf, fragments):
+	"""
+	Connects the nets of fragments of different tiles which
+	overlap on the same layer (the same shape seen by both tiles).
+
+	Args:
+		fragments: list of (layer, points, net key, tile)
+	"""
+	by_layer = defaultdict(list)
+	for fragment in fragments:
+		by_layer[fragment[0]].append(fragment)
+
+	for layer, frags in by_layer.items():
+		shapes = [Polygon(pts) for _, pts, _, _ in frags]
+		pairs = STRtree(shapes).query(shapes, predicate = "intersects")
+		pairs = pairs[:, pairs[0] < pairs[1]]
+		tiles = numpy.array([tile for _, _, _, tile in frags])
+		pairs = pairs[:, tiles[pairs[0]] != tiles[pairs[1]]]
+		if pairs.shape[1] == 0:
+			continue
+
+		shapes = numpy.array(shapes, dtype = object)
+		crossing = ~touches(shapes[pairs[0]], shapes[pairs[1]])
+		for i, j in pairs[:, crossing].T:
+			uf.union(frags[i][2], frags[j][2])
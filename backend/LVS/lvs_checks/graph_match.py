@@ -0,0 +1,551 @@
+from collections import defaultdict, deque
+import heapq
+
+# Layout candidates tried for an ambiguous schematic node before keeping the least bad one
+MAX_BACKTRACK = 8
+
+# Nets on more leftover layout devices (supplies) are too common to propose pairing candidates
+MAX_FANOUT = 64
+
+def normalize_model(model):
+	m = str(model).lower()
+	if m in ["p", "pmos"]: return "PMOS"
+	if m in ["n", "nmos"]: return "NMOS"
+	return str(model).upper()
+
+#==========================================================================
+
+def terminal_roles(dev):
+	"""
+	Role of each terminal of a device. Drain and source of a MOSFET (and
+	the two ends of a resistor, capacitor or inductor) share a role, so
+	they can be swapped; subcircuit pins are matched by position.
+	"""
+	n = len(dev["nets"])
+	if dev["type"] == "M" and n == 4:
+		return (0, 1, 0, 2)
+	if dev["type"] in ("R", "C", "L") and n == 2:
+		return (0, 0)
+	return tuple(range(n))
+
+#==========================================================================
+
+def device_kind(dev):
+	return (dev["type"], normalize_model(dev["model"]), len(dev["nets"]))
+
+#==========================================================================
+
+class Partition:
+	"""
+	Colour refinement (Weisfeiler-Lehman) of the device/net graphs of both
+	netlists at once: a class is split by the number of edges of each role
+	its nodes have into a splitter class. Splitters are queued the Hopcroft
+	way (all fragments but the largest), which keeps the refinement near
+	linear. Every move is recorded so that a guess can be undone.
+
+	A class holding more nodes of one netlist than of the other is an error
+	region: it is not used as a splitter (deferred), so that an error does 
+	not spread through the labels of the whole circuit.
+	"""
+	def __init__(self, side, adjacency, labels, hints = None):
+		self.side = side				# node -> 0 (schematic) or 1 (layout)
+		self.adjacency = adjacency		# node -> [(neighbour, role)]
+		self.hints = hints or [None] * len(side)	# node -> partner preferred when guessing (device size) or None
+		self.cls = [None] * len(side)
+		self.members = {}				# class -> set of nodes
+		self.counts = {}				# class -> [schematic nodes, layout nodes]
+		self.imbalance = 0				# sum of |schematic - layout| over the classes
+		self.trail = []
+		self.next_id = 0
+		self.queue = deque()
+		self.queued = set()
+		self.deferred = set()			# classes skipped as splitters while unbalanced
+		self.heaps = {}					# class -> {(side,) or (side, hint): min-heap of nodes}, stale entries dropped lazily
+		self.mixed = set()				# classes found not interchangeable
+		self.hinted = set()				# classes already tried for a split by hint
+
+		groups = {}
+		for node, label in enumerate(labels):
+			if label not in groups:
+				groups[label] = self.new_class()
+				self.push(groups[label])
+			self.move(node, groups[label])
+		self.trail = []
+
+	def new_class(self):
+		cid = self.next_id
+		self.next_id += 1
+		self.members[cid] = set()
+		self.counts[cid] = [0, 0]
+		self.trail.append((None, cid, None))
+		return cid
+
+	def push(self, cid):
+		if cid not in self.queued:
+			self.queued.add(cid)
+			self.queue.append(cid)
+
+	def move(self, node, to, record = True):
+		side = self.side[node]
+		old = self.cls[node]
+		if old is not None:
+			self.members[old].discard(node)
+			self.count(old, side, -1)
+		self.cls[node] = to
+		self.members[to].add(node)
+		self.count(to, side, 1)
+		if to in self.heaps:
+			self.heap_push(to, node)
+		if record:
+			self.trail.append((node, old, to))
+
+	def move_all(self, nodes, old, to):
+		"""Moves nodes of class old to class to (the bulk version of move)"""
+		members = self.members[old]
+		members.difference_update(nodes)
+		self.members[to].update(nodes)
+		cls = self.cls
+		layout = 0
+		for node in nodes:
+			cls[node] = to
+			layout += self.side[node]
+		if to in self.heaps:
+			for node in nodes:
+				self.heap_push(to, node)
+		for side, n in ((0, len(nodes) - layout), (1, layout)):
+			if n:
+				self.count(old, side, -n)
+				self.count(to, side, n)
+		self.trail.extend((node, old, to) for node in nodes)
+
+	def count(self, cid, side, step):
+		counts = self.counts[cid]
+		self.imbalance -= abs(counts[0] - counts[1])
+		counts[side] += step
+		self.imbalance += abs(counts[0] - counts[1])
+
+	def refine(self):
+		"""Splits the classes until every class is stable against every other"""
+		while self.queue:
+			splitter = self.queue.popleft()
+			self.queued.discard(splitter)
+			counts = self.counts[splitter]
+			if counts[0] != counts[1]:
+				self.deferred.add(splitter)
+				continue
+			self.deferred.discard(splitter)
+
+			hits = {}
+			for x in self.members[splitter]:
+				for v, role in self.adjacency[x]:
+					h = hits.get(v)
+					if h is None:
+						hits[v] = h = {}
+					h[role] = h.get(role, 0) + 1
+
+			by_class = defaultdict(dict)
+			cls = self.cls
+			for v, h in hits.items():
+				groups = by_class[cls[v]]
+				key = tuple(sorted(h.items())) if len(h) > 1 else tuple(h.items())
+				if key in groups:
+					groups[key].append(v)
+				else:
+					groups[key] = [v]
+
+			for cid, groups in by_class.items():
+				rest = len(self.members[cid]) - sum(len(g) for g in groups.values())
+				if rest == 0 and len(groups) == 1:
+					continue
+				fragments = sorted(groups.values(), key = len, reverse = True)
+				if rest == 0:
+					# The largest fragment keeps the class
+					fragments = fragments[1:]
+
+				# A class never used as a splitter hands that over to all its fragments
+				was_queued = cid in self.queued or cid in self.deferred
+				if cid in self.deferred:
+					self.push(cid)
+				largest = cid
+				size = len(self.members[cid]) - sum(len(f) for f in fragments)
+				for fragment in fragments:
+					new = self.new_class()
+					self.move_all(fragment, cid, new)
+					if was_queued:
+						self.push(new)
+					elif len(fragment) > size:
+						self.push(largest)
+						largest, size = new, len(fragment)
+					else:
+						self.push(new)
+
+	def individualize(self, a, b):
+		"""Gives a schematic node and a layout node of one class a class of their own, then refines"""
+		cid = self.cls[a]
+		new = self.new_class()
+		self.move(a, new)
+		self.move(b, new)
+		self.push(new)
+		if len(self.members[cid]) < 2:
+			self.push(cid)
+		self.refine()
+
+	def split_by_hint(self, cid):
+		"""
+		Splits a class the topology cannot resolve by the hints of its members
+		(device sizes) when every hint has as many schematic as layout members,
+		then refines. Returns whether the class was split.
+		"""
+		if cid in self.hinted:
+			return False
+		self.hinted.add(cid)
+		groups = defaultdict(lambda: ([], []))
+		for node in self.members[cid]:
+			groups[self.hints[node]][self.side[node]].append(node)
+		if len(groups) < 2 or any(len(nodes1) != len(nodes2) for nodes1, nodes2 in groups.values()):
+			return False
+
+		order = sorted(groups, key = lambda hint: (hint is None, hint or ()))
+		for hint in order[1:]:
+			new = self.new_class()
+			self.move_all(groups[hint][0] + groups[hint][1], cid, new)
+			self.push(new)
+		self.push(cid)
+		self.refine()
+		return True
+
+	def pair_interchangeable(self, cid):
+		"""
+		Pairs the members of a class at once when the members of each side 
+		have the very same connections (parallel devices), as any pairing 
+		is then as good as any other. Returns False if they do not; a class
+		is only examined once, what is left of it after a guess is not.
+		"""
+		if cid in self.mixed:
+			return False
+		sides = ([], [])
+		for node in self.members[cid]:
+			sides[self.side[node]].append(node)
+		for group in sides:
+			first = sorted(self.adjacency[group[0]])
+			if any(sorted(self.adjacency[node]) != first for node in group[1:]):
+				self.mixed.add(cid)
+				return False
+
+		# By size, so that parallel devices of the same size pair up
+		by_size = lambda node: (self.hints[node] or (), node)
+		for a, b in zip(sorted(sides[0], key = by_size), sorted(sides[1], key = by_size)):
+			new = self.new_class()
+			self.move(a, new)
+			self.move(b, new)
+			self.push(new)
+		self.push(cid)
+		self.refine()
+		return True
+
+	def heap_push(self, cid, node):
+		heaps = self.heaps[cid]
+		side = self.side[node]
+		heapq.heappush(heaps.setdefault((side,), []), node)
+		if self.hints[node] is not None:
+			heapq.heappush(heaps.setdefault((side, self.hints[node]), []), node)
+
+	def smallest(self, cid, side, k, hint = None):
+		"""The k smallest nodes of one side of a class, those with the given hint first"""
+		if cid not in self.heaps:
+			self.heaps[cid] = {}
+			for node in self.members[cid]:
+				self.heap_push(cid, node)
+		found = []
+		for key in ([(side, hint)] if hint is not None else []) + [(side,)]:
+			heap = self.heaps[cid].get(key, [])
+			popped = []
+			while heap and len(found) < k:
+				node = heapq.heappop(heap)
+				if self.cls[node] == cid and node not in popped:
+					popped.append(node)
+					if node not in found:
+						found.append(node)
+			for node in popped:
+				heapq.heappush(heap, node)
+		return found
+
+	def undo(self, mark):
+		"""Reverts every move made since len(trail) was mark"""
+		while len(self.trail) > mark:
+			node, old, new = self.trail.pop()
+			if node is None:
+				del self.members[old]
+				del self.counts[old]
+				self.heaps.pop(old, None)
+			else:
+				self.move(node, old, record = False)
+
+	def ambiguous(self, cid):
+		counts = self.counts.get(cid)
+		return counts is not None and counts[0] >= 1 and counts[1] >= 1 and counts[0] + counts[1] > 2
+
+#==========================================================================
+
+def size_hint(dev):
+	"""
+	(L, W) of a device to the nm, or None: among devices the topology cannot
+	tell apart, one of the same size is tried first
+	"""
+	size = dev.get("size")
+	if size is None:
+		return None
+	return tuple(round(x, 3) for x in size)
+
+#==========================================================================
+
+def build_graph(subs):
+	"""
+	Device and net nodes of the netlists (schematic first), their labels
+	(device kind; port name for ports, which seeds the matching), edges 
+	and size hints
+	"""
+	side, labels, adjacency, hints, index = [], [], [], [], []
+	for s, sub in enumerate(subs):
+		ports = set(sub["ports"])
+		devices = {}
+		for i, dev in enumerate(sub["devices"]):
+			devices[i] = len(side)
+			side.append(s)
+			labels.append(("D",) + device_kind(dev))
+			adjacency.append([])
+			hints.append(size_hint(dev))
+
+		nets = {}
+		def net_node(net):
+			if net not in nets:
+				nets[net] = len(side)
+				side.append(s)
+				labels.append(("P", net) if net in ports else ("N",))
+				adjacency.append([])
+				hints.append(None)
+			return nets[net]
+
+		for port in sub["ports"]:
+			net_node(port)
+		for i, dev in enumerate(sub["devices"]):
+			for net, role in zip(dev["nets"], terminal_roles(dev)):
+				n = net_node(net)
+				adjacency[devices[i]].append((n, role))
+				adjacency[n].append((devices[i], role))
+		index.append((devices, nets))
+	return side, labels, adjacency, hints, index
+
+#==========================================================================
+
+def orientation(dev1, dev2, net_map):
+	"""
+	Terminal order of dev2 facing the terminals of dev1: drain and source
+	(or the ends of a two terminal passive) are swapped if that connects better
+	"""
+	order = list(range(len(dev2["nets"])))
+	roles = terminal_roles(dev1)
+	pair = [i for i, r in enumerate(roles) if roles.count(r) == 2][:2]
+	if len(pair) == 2 and len(dev2["nets"]) == len(dev1["nets"]):
+		i, j = pair
+		swapped = list(order)
+		swapped[i], swapped[j] = j, i
+		score = lambda o: sum(net_map.get(dev1["nets"][k]) == dev2["nets"][o[k]] for k in range(len(o)))
+		if score(swapped) > score(order):
+			return swapped
+	return order
+
+#==========================================================================
+
+def terminal_keys(dev, nets):
+	"""Terminal nets of a device as keys, the second with drain and source (or the two ends) swapped"""
+	keys = [tuple(nets)]
+	roles = terminal_roles(dev)
+	pair = [i for i, r in enumerate(roles) if roles.count(r) == 2][:2]
+	if len(pair) == 2:
+		i, j = pair
+		swapped = list(nets)
+		swapped[i], swapped[j] = swapped[j], swapped[i]
+		if swapped != nets:
+			keys.append(tuple(swapped))
+	return keys
+
+#==========================================================================
+
+def pair_remaining(sub1, sub2, rest1, rest2, net_map):
+	"""
+	Pairs the devices left unmatched (the region of the errors) by kind,
+	most shared connections first. Devices whose terminals all map onto
+	each other are paired through a table of the layout terminal nets;
+	other candidates come from the layout devices on the same nets and 
+	only those are scored.
+
+	Returns:
+		dict: {schematic device: layout device}, set of schematic devices paired without a shared net,
+		[unpaired schematic devices], [unpaired layout devices]
+	"""
+	kinds = defaultdict(lambda: ([], []))
+	for i in sorted(rest1):
+		kinds[device_kind(sub1["devices"][i])][0].append(i)
+	for j in sorted(rest2):
+		kinds[device_kind(sub2["devices"][j])][1].append(j)
+
+	paired = {}
+	guessed = set()
+	left1, left2 = [], []
+	for kind, (devs1, devs2) in kinds.items():
+		by_nets = defaultdict(deque)		# terminal nets -> layout devices
+		by_net = defaultdict(list)			# net -> layout devices
+		for j in devs2:
+			nets2 = sub2["devices"][j]["nets"]
+			by_nets[tuple(nets2)].append(j)
+			for net in set(nets2):
+				by_net[net].append(j)
+		used1, used2 = set(), set()
+
+		# All terminals shared
+		for i in devs1:
+			d1 = sub1["devices"][i]
+			best = None
+			for key in terminal_keys(d1, [net_map.get(net) for net in d1["nets"]]):
+				bucket = by_nets.get(key)
+				while bucket and bucket[0] in used2:
+					bucket.popleft()
+				if bucket and (best is None or bucket[0] < best):
+					best = bucket[0]
+			if best is not None:
+				paired[i] = best
+				used1.add(i)
+				used2.add(best)
+
+		# Some terminals shared
+		heap = []
+		for i in devs1:
+			if i in used1:
+				continue
+			d1 = sub1["devices"][i]
+			candidates = set()
+			for net in d1["nets"]:
+				bucket = by_net.get(net_map.get(net), ())
+				if len(bucket) <= MAX_FANOUT:
+					candidates.update(bucket)
+			for j in candidates - used2:
+				d2 = sub2["devices"][j]
+				o = orientation(d1, d2, net_map)
+				score = sum(net_map.get(d1["nets"][k]) == d2["nets"][o[k]] for k in range(len(o)))
+				if score > 0:
+					heap.append((-score, i, j))
+		heapq.heapify(heap)
+		while heap:
+			_, i, j = heapq.heappop(heap)
+			if i not in used1 and j not in used2:
+				paired[i] = j
+				used1.add(i)
+				used2.add(j)
+
+		# Nothing shared, in order
+		rest1 = [i for i in devs1 if i not in used1]
+		rest2 = [j for j in devs2 if j not in used2]
+		for i, j in zip(rest1, rest2):
+			paired[i] = j
+			guessed.add(i)
+		left1.extend(rest1[len(rest2):])
+		left2.extend(rest2[len(rest1):])
+
+	return paired, guessed, sorted(left1), sorted(left2)
+
+#==========================================================================
+
+def match_netlists(sub1, sub2):
+	"""
+	Finds the correspondence between the devices and nets of a schematic
+	subcircuit (sub1) and a layout subcircuit (sub2) by colour refinement,
+	with the ports as seeds. Classes still holding several candidates are
+	split by device size where the sizes agree, then resolved by 
+	individualizing one pair at a time (a device of the same size first); 
+	a pair that makes the partition less balanced is undone and the next 
+	candidate tried.
+
+	Returns:
+		dict: {
+			"devices": {schematic device index: layout device index} (topology and error region pairs),
+			"exact": set of schematic device indices matched by topology,
+			"guessed": set of schematic device indices paired by kind alone (no shared net),
+			"orientation": {schematic device index: terminal order of its layout device},
+			"nets": {schematic net: layout net}, ports of the same name always included,
+			"unmatched": ([schematic device indices], [layout device indices]) without a device of their kind
+		}
+	"""
+	side, labels, adjacency, hints, index = build_graph((sub1, sub2))
+	partition = Partition(side, adjacency, labels, hints)
+	partition.refine()
+	for cid in sorted(partition.members):
+		if partition.ambiguous(cid):
+			partition.split_by_hint(cid)
+
+	pending = sorted((c for c in partition.members if partition.ambiguous(c)),
+					 key = lambda c: (-len(partition.members[c]), -min(partition.members[c])))
+	while pending:
+		cid = pending.pop()
+		if not partition.ambiguous(cid):
+			continue
+		start = len(partition.trail)
+		if partition.split_by_hint(cid) or partition.pair_interchangeable(cid):
+			candidates = []
+		else:
+			a = partition.smallest(cid, 0, 1)[0]
+			candidates = partition.smallest(cid, 1, MAX_BACKTRACK, hints[a])
+
+		best = None
+		for b in candidates:
+			before = partition.imbalance
+			partition.individualize(a, b)
+			increase = partition.imbalance - before
+			if increase <= 0:
+				best = None
+				break
+			if best is None or increase < best[0]:
+				best = (increase, b)
+			partition.undo(start)
+		if best is not None:
+			partition.individualize(a, best[1])
+
+		created = sorted({new for node, _, new in partition.trail[start:] if node is not None}, reverse = True)
+		pending.extend(c for c in [cid] + created if partition.ambiguous(c))
+
+	devices1, nets1 = index[0]
+	devices2, nets2 = index[1]
+	node_device = {node: i for i, node in devices2.items()}
+	node_net = {node: net for net, node in nets2.items()}
+
+	net_map = {}
+	for net, node in nets1.items():
+		members = partition.members[partition.cls[node]]
+		if partition.counts[partition.cls[node]] == [1, 1]:
+			other = next(n for n in members if n != node)
+			net_map[net] = node_net[other]
+
+	# A port is the same net on both sides even when an error leaves its class unbalanced
+	mapped = set(net_map.values())
+	ports2 = set(sub2["ports"])
+	for port in sub1["ports"]:
+		if port not in net_map and port in ports2 and port in nets2 and port not in mapped:
+			net_map[port] = port
+			mapped.add(port)
+
+	dev_map = {}
+	for i, node in devices1.items():
+		if partition.counts[partition.cls[node]] == [1, 1]:
+			other = next(n for n in partition.members[partition.cls[node]] if n != node)
+			dev_map[i] = node_device[other]
+	exact = set(dev_map)
+
+	rest1 = [i for i in devices1 if i not in dev_map]
+	matched2 = set(dev_map.values())
+	rest2 = [j for j in devices2 if j not in matched2]
+	paired, guessed, left1, left2 = pair_remaining(sub1, sub2, rest1, rest2, net_map)
+	dev_map.update(paired)
+
+	orient = {i: orientation(sub1["devices"][i], sub2["devices"][j], net_map) for i, j in dev_map.items()}
+
+	return {"devices": dev_map, "exact": exact, "guessed": guessed, "orientation": orient, "nets": net_map, "unmatched": (left1, left2)}
@@ -1,13 +1,17 @@
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
 # -----------------------------
 # Parse SPICE Subcircuits
 # -----------------------------
 
-def read_logical_lines(path):
+def iter_logical_lines(path):
 	"""
-	Read file and join continuation lines that start with '+' into previous line.
-	Returns list of logical (full) lines.
+	Read file line by line and join continuation lines that start with '+' into previous line.
+	Yields logical (full) lines.
 	"""
-	lines = []
 	with open(path) as f:
 		prev = None
 		for raw in f:
@@ -27,12 +31,47 @@ def read_logical_lines(path):
 			else:
 				# start a new logical line
 				if prev is not None:
-					lines.append(prev)
+					yield prev
 				prev = s
 		# append last
 		if prev is not None:
-			lines.append(prev)
-	return lines
+			yield prev
+
+
+def read_logical_lines(path):
+	"""Returns list of logical (full) lines."""
+	return list(iter_logical_lines(path))
+
+#==========================================================================
+
+def iter_subckts(path):
+	"""
+	Splits the netlist into subcircuits in one pass over its logical lines.
+	Yields (name, ports, body) for every subcircuit, body being its logical 
+	lines (left unsplit, callers tokenize the lines they need). 
+	Lines outside subcircuits are skipped.
+	"""
+	name = None
+	for line in iter_logical_lines(path):
+		if line[0] == '.':
+			lw = line.lower()
+			if lw.startswith('.subckt'):
+				if name is not None:
+					yield name, ports, body
+				parts = line.split()
+				name, ports, body = (parts[1], parts[2:], []) if len(parts) > 1 else (None, None, None)
+				continue
+			if lw.startswith('.ends'):
+				# optionally .ends <name> or just .ends
+				if name is not None:
+					yield name, ports, body
+				name = None
+				continue
+		if name is not None:
+			body.append(line)
+
+	if name is not None:
+		yield name, ports, body
 
 #==========================================================================
 
@@ -40,91 +79,137 @@ def parse_netlist(path):
 	"""
 	Returns dict:
 	  { subckt_name: { 'name': name, 'ports': [...], 'devices': [ {inst, type, nets, model, params}, ... ] } }
+	MOSFETs also carry 'size': (L, W) in μm (None if not given).
 	"""
-	logical = read_logical_lines(path)
 	subckts = {}
-	in_subckt = None
-
-	for line in logical:
-		lw = line.lower()
-		if lw.startswith('.subckt'):
-			parts = line.split()
-			name = parts[1]
-			ports = parts[2:]
-			in_subckt = name
-			subckts[name] = {'name': name, 'ports': ports, 'devices': []}
-			continue
-
-		if lw.startswith('.ends'):
-			# optionally .ends <name> or just .ends
-			in_subckt = None
-			continue
-
-		if in_subckt is None:
-			continue
-
-		# inside subckt: parse device/instance line
-		tokens = line.split()
-		if not tokens:
-			continue
-
-		inst = tokens[0]
-		prefix = inst[0].upper()
-		rest = tokens[1:]  # everything after instance token
-
-		# Skip malformed or comment-like lines
-		if prefix == '+':
-			continue
-
-		dev = {'inst': inst, 'type': prefix, 'nets': [], 'model': None, 'params': {}}
-
-		if prefix == 'M':
-			# MOSFET: expect at least 5 tokens after inst: D G S B MODEL
-			if len(rest) < 5:
-				# malformed; store raw for debugging
-				dev['nets'] = rest
-				subckts[in_subckt]['devices'].append(dev)
-				continue
 
-			dev['nets'] = rest[:4]
-			dev['model'] = rest[4]
-			# remaining tokens are params like W=1.86U L=0.184U or standalone tokens
-			for tok in rest[5:]:
+	for name, ports, body in iter_subckts(path):
+		devices = [parse_device(line.split()) for line in body]
+		subckts[name] = {'name': name, 'ports': ports, 'devices': devices}
+
+	return subckts
+
+#==========================================================================
+
+def read_dimension(val):
+	"""Length in μm of a W/L value such as 1.86U, 180n or 0.5"""
+	if isinstance(val, (int, float)):
+		return float(val)
+
+	val = val.strip().lower()
+
+	if val.endswith('u'):
+		return float(val[:-1])		  # μm
+	if val.endswith('n'):
+		return float(val[:-1]) * 1e-3   # nm → μm
+	if val.endswith('m'):
+		return float(val[:-1]) * 1e3	# mm → μm
+
+	return float(val)				   # already in μm
+
+#==========================================================================
+
+def parse_size(params):
+	"""(L, W) in μm from the params of a MOSFET, None if either is missing or unreadable"""
+	params = {k.lower(): v for k, v in params.items()}
+	try:
+		return (read_dimension(params["l"]), read_dimension(params["w"]))
+	except (KeyError, ValueError, AttributeError):
+		return None
+
+#==========================================================================
+
+def parse_device(tokens):
+	"""Parses the tokens of one device/instance line"""
+	inst = tokens[0]
+	prefix = inst[0].upper()
+	rest = tokens[1:]  # everything after instance token
+
+	dev = {'inst': inst, 'type': prefix, 'nets': [], 'model': None, 'params': {}}
+
+	if prefix == 'M':
+		# MOSFET: expect at least 5 tokens after inst: D G S B MODEL
+		if len(rest) < 5:
+			# malformed; store raw for debugging
+			dev['nets'] = rest
+			return dev
+
+		dev['nets'] = rest[:4]
+		dev['model'] = rest[4]
+		# remaining tokens are params like W=1.86U L=0.184U or standalone tokens
+		for tok in rest[5:]:
+			if '=' in tok:
+				k, v = tok.split('=', 1)
+				dev['params'][k] = v
+			else:
+				# some tools output params without '=' (rare) — store as flag
+				dev['params'].setdefault(tok, True)
+		# W/L read once here, the size check compares these
+		dev['size'] = parse_size(dev['params'])
+
+	elif prefix == 'X':
+		# subckt inst: last token is subckt name, preceding are nets
+		if len(rest) >= 1:
+			dev['nets'] = rest[:-1]
+			dev['model'] = rest[-1]  # the subckt name
+		else:
+			dev['nets'] = []
+			dev['model'] = None
+
+		# optional named params after subckt name aren't handled here, but could be parsed
+
+	else:
+		# General passive / other device: R, C, L, D, Q, etc.
+		# typical: inst n1 n2 VALUE [params...]
+		if len(rest) >= 3:
+			dev['nets'] = rest[:2]
+			dev['model'] = rest[2]  # value or model name
+			for tok in rest[3:]:
 				if '=' in tok:
 					k, v = tok.split('=', 1)
 					dev['params'][k] = v
 				else:
-					# some tools output params without '=' (rare) — store as flag
 					dev['params'].setdefault(tok, True)
+		else:
+			# fewer tokens than expected: put everything into nets for debugging
+			dev['nets'] = rest
 
-		elif prefix == 'X':
-			# subckt inst: last token is subckt name, preceding are nets
-			if len(rest) >= 1:
-				dev['nets'] = rest[:-1]
-				dev['model'] = rest[-1]  # the subckt name
-			else:
-				dev['nets'] = []
-				dev['model'] = None
+	return dev
 
-			# optional named params after subckt name aren't handled here, but could be parsed
 
-		else:
-			# General passive / other device: R, C, L, D, Q, etc.
-			# typical: inst n1 n2 VALUE [params...]
-			if len(rest) >= 3:
-				dev['nets'] = rest[:2]
-				dev['model'] = rest[2]  # value or model name
-				for tok in rest[3:]:
-					if '=' in tok:
-						k, v = tok.split('=', 1)
-						dev['params'][k] = v
-					else:
-						dev['params'].setdefault(tok, True)
-			else:
-				# fewer tokens than expected: put everything into nets for debugging
-				dev['nets'] = rest
+#==========================================================================
 
-		subckts[in_subckt]['devices'].append(dev)
+# Parsed netlists of this process, least recently used first: {(device, inode): (mtime, size, sha256, subckts)}
+netlist_cache = OrderedDict()
+netlist_lock = threading.Lock()
+NETLIST_CACHE_SIZE = 8
 
+def load_netlist(path):
+	"""
+	Returns parse_netlist(path), reusing the last parse of path while the 
+	file is unchanged: same mtime and size, or else the same content hash.
+	The returned dict is shared between callers and must not be modified.
+	"""
+	path = os.path.abspath(path)
+	stat = os.stat(path)
+	key = (stat.st_dev, stat.st_ino)
+	with netlist_lock:
+		cached = netlist_cache.get(key)
+		if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+			netlist_cache.move_to_end(key)
+			return cached[3]
+		
+	with open(path, "rb") as f:
+		digest = hashlib.sha256(f.read()).hexdigest()
+	
+	if cached is not None and cached[2] == digest:
+		subckts = cached[3]
+	else:
+		subckts = parse_netlist(path)
+		
+	with netlist_lock:
+		netlist_cache[key] = (stat.st_mtime_ns, stat.st_size, digest, subckts)
+		netlist_cache.move_to_end(key)
+		while len(netlist_cache) > NETLIST_CACHE_SIZE:
+			netlist_cache.popitem(last=False)
 	return subckts
-
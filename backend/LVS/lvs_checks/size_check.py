@@ -1,6 +1,13 @@
 import re
 import json
-from collections import defaultdict
+import bisect
+from collections import defaultdict, deque
+
+from .context import CellContext
+from .parser import parse_size
+
+# Relative W/L difference allowed between a schematic and a layout device
+SIZE_TOLERANCE = 0.02
 
 def normalize_model(model):
 	m = model.lower()
@@ -16,29 +23,12 @@ def normalize_param(param):
 		new_param[key.lower()] = val
 	return new_param
 
-#==========================================================================
-def read_dimension(val):
-	if isinstance(val, (int, float)):
-		return float(val)
-
-	val = val.strip().lower()
-
-	if val.endswith('u'):
-		return float(val[:-1])		  # μm
-	if val.endswith('n'):
-		return float(val[:-1]) * 1e-3   # nm → μm
-	if val.endswith('m'):
-		return float(val[:-1]) * 1e3	# mm → μm
-
-	return float(val)				   # already in μm
-
 #==========================================================================
 	
-def match_with_tolerance(t1, t2, tol=0.02):
-	t1[0] = read_dimension(t1[0])
-	t1[1] = read_dimension(t1[1])
-	t2[0] = read_dimension(t2[0])
-	t2[1] = read_dimension(t2[1])
+def match_with_tolerance(t1, t2, tol=SIZE_TOLERANCE):
+	"""Whether the (L, W) of t2 are within tol of the (L, W) of t1"""
+	if t1 is None or t2 is None:
+		return t1 is None and t2 is None
 	return (
 		abs(t1[0] - t2[0]) <= tol * abs(t1[0]) and
 		abs(t1[1] - t2[1]) <= tol * abs(t1[1])
@@ -46,60 +36,14 @@ def match_with_tolerance(t1, t2, tol=0.02):
 	
 #==========================================================================
 
-def canonicalize_devices(ports, devlist):
-	"""
-	Canonicalize MOSFET devices in a topology-based,
-	order-independent way.
-	"""
-	port_set = set(ports)
-
-	# 1. Build connectivity signature for each internal net
-	net_connections = defaultdict(list)
-
-	for d in devlist:
-		for num, role in enumerate(["d", "g", "s", "b"]):
-			net = d["nets"][num]
-			if net not in port_set:
-				# Store type + role (D/G/S/B) for grouping
-				net_connections[net].append((normalize_model(d["model"]), role))
-
-	# 2. Assign deterministic IDs based on sorted connectivity signatures
-	internal_map = {}
-	for idx, (net, conn) in enumerate(
-		sorted(net_connections.items(), key=lambda x: sorted(x[1]))
-	):
-		internal_map[net] = f"INT_{idx+1}"
-
-	# 3. Convert each device into canonical signature
-	def map_net(n):
-		if n in port_set:
-			return f"PORT_{n}"
-		return internal_map[n]
-		
-	canonical = []
-	for d in devlist:
-		D = map_net(d["nets"][0])
-		G = map_net(d["nets"][1])
-		S = map_net(d["nets"][2])
-		B = map_net(d["nets"][3])
-
-		# Device signature is order-independent by sorting nets
-		params = normalize_param(d["params"])
-		signature = (
-			normalize_model(d["model"]),
-			tuple(sorted([D, G, S, B])),
-			d["inst"],
-			params["l"],
-			params["w"]
-		)
-		canonical.append(signature)
-
-	# Sort entire device list for final canonical form
-	canonical.sort()
-	return canonical
-
-#==========================================================================	
-	
+def dimensions(d):
+	"""(L, W) in μm of a device, read at parse time"""
+	if "size" in d:
+		return d["size"]
+	return parse_size(d["params"])
+
+#==========================================================================
+
 #def canonicalize_devices(devlist):
 #	#print(devlist)
 #	dev_sizes = []
@@ -118,45 +62,77 @@ def canonicalize_devices(ports, devlist):
 # Compare two subcircuits for device size mismatch
 # -------------------------------------------------
 
-def compare_size(sub1, sub2):
-	sig1 = canonicalize_devices(sub1["ports"], sub1["devices"])
-	sig2 = canonicalize_devices(sub2["ports"], sub2["devices"])
+def device_size(d):
+	"""(instance, L, W) of a device as written in its netlist"""
+	params = normalize_param(d["params"])
+	return (d["inst"], params.get("l"), params.get("w"))
+
+#==========================================================================
+
+def compare_size(sub1, sub2, context = None, tol = SIZE_TOLERANCE):
+	"""
+	W/L of the MOSFETs (subcircuit instances are sized in their own cell).
+	Devices paired by the netlist correspondence (by topology or shared 
+	nets) must agree within the tolerance; the others, unpaired or only 
+	paired by kind, are paired by model and size, and what is left has 
+	no counterpart.
+	"""
+	if context is None:
+		context = CellContext(sub1, sub2)
+	devs1 = sub1["devices"]
+	devs2 = sub2["devices"]
 	
-	#--------------------matches nets-------------------
+	#--------------------matched devices----------------
 	diff = []
-	sig1_remaining = []
-	sig2_copy = []
-	for s1 in sig1:
-		flag = 0
-		for s2 in sig2:
-			if s1[:2] == s2[:2]:
-				if not match_with_tolerance(list(s1[3:]), list(s2[3:])):
-					diff.append(("Schematic", s1[2:], "Layout", s2[2:]))
-				flag = 1
-				sig2_copy.append(s2)
-				break
-				
-		if flag == 0:
-			sig1_remaining.append(s1)
+	for i, j in context.devices.items():
+		if devs1[i]["type"] == "M" and i not in context.guessed:
+			if not match_with_tolerance(dimensions(devs1[i]), dimensions(devs2[j]), tol):
+				diff.append(("Schematic", device_size(devs1[i]), "Layout", device_size(devs2[j])))
 	
 	#-----------matches device types, W and L-----------
-	sig1_matched = []
-	sig2_matched = []
-	sig2_remaining = set(sig2) - set(sig2_copy)
-	for s1 in sig1_remaining:
-		for s2 in sig2_remaining:
-			if s1[0] == s2[0]:
-				if match_with_tolerance(list(s1[3:]), list(s2[3:])):
-					sig1_matched.append(s1)
-					sig2_matched.append(s2)
+	# Unpaired layout devices by kind, sorted by W: the candidates of a
+	# schematic device are the window of W within the tolerance
+	guessed = sorted(context.guessed)
+	only1 = sorted(context.unmatched[0] + guessed)
+	only2 = sorted(context.unmatched[1] + [context.devices[i] for i in guessed])
+	buckets = defaultdict(list)
+	unsized = defaultdict(deque)
+	for j in only2:
+		if devs2[j]["type"] == "M":
+			size = dimensions(devs2[j])
+			if size is None:
+				unsized[context.kinds2[j]].append(j)
+			else:
+				buckets[context.kinds2[j]].append((size[1], size[0], j))
+	for bucket in buckets.values():
+		bucket.sort()
 	
-	sig1_remaining = set(sig1_remaining) - set(sig1_matched)	
-	sig2_remaining = set(sig2_remaining) - set(sig2_matched)
+	for i in only1:
+		if devs1[i]["type"] != "M":
+			continue
+		kind = context.kinds1[i]
+		size = dimensions(devs1[i])
+		found = False
+		if size is None:
+			if unsized[kind]:
+				unsized[kind].popleft()
+				found = True
+		else:
+			l, w = size
+			bucket = buckets[kind]
+			k = bisect.bisect_left(bucket, (w - tol * abs(w),))
+			while k < len(bucket) and bucket[k][0] <= w + tol * abs(w):
+				if abs(l - bucket[k][1]) <= tol * abs(l):
+					del bucket[k]
+					found = True
+					break
+				k += 1
+		if not found:
+			diff.append(("Schematic", device_size(devs1[i]), "Layout", (None, None, None)))
 	
-	for s1 in sig1_remaining:
-		diff.append(("Schematic", s1[2:], "Layout", (None, None, None)))
-	for s2 in sig2_remaining:
-		diff.append(("Schematic", (None, None, None), "Layout", s2[2:]))
+	sig2_remaining = sorted([j for bucket in buckets.values() for _, _, j in bucket] + [j for js in unsized.values() for j in js])
+	for j in sig2_remaining:
+		diff.append(("Schematic", (None, None, None), "Layout", device_size(devs2[j])))
 	
 	return diff
 		
@@ -164,12 +140,12 @@ def compare_size(sub1, sub2):
 # -------------------------------------------------
 # Main compare function
 # -------------------------------------------------
-def size_check_fun(cellname, source_netlist, layout_netlist, skip_cell=[]):
+def size_check_fun(cellname, source_netlist, layout_netlist, skip_cell=[], context=None, tol=SIZE_TOLERANCE):
 	final = {}
 	
 	if cellname not in skip_cell and cellname in source_netlist and cellname in layout_netlist:
 
-		final[cellname] = compare_size(source_netlist[cellname], layout_netlist[cellname])
+		final[cellname] = compare_size(source_netlist[cellname], layout_netlist[cellname], context, tol)
 
 	return final
 
@@ -1,87 +1,182 @@
-from .lvs_checks.parser import parse_netlist
+from .lvs_checks.parser import load_netlist
 from .lvs_checks.port_check import port_check_fun
 from .lvs_checks.dev_nets_check import dev_nets_checker
-from .lvs_checks.size_check import size_check_fun
+from .lvs_checks.size_check import size_check_fun, SIZE_TOLERANCE
 from .lvs_checks.opens_shorts_check import opens_shorts_checker
+from .lvs_checks.context import cell_context
 from .cdl_maker import layout_to_cdl as l2c
 from .report_maker import make_report
+from .progress import stage, emit, cell_scope
+from .extraction_cache import extraction_key, load_cached, store_cached, gds_structures, subtree_shapes
 
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 #==========================================================================
 
-def lvs_runner(inputs):
+def run_cell(inputs, cell, layout):
+	"""
+	Extracts and checks one cell (runs in a worker process in the parallel mode).
+	layout is gds_structures of inputs["layout"], scanned once per run.
+	
+	Returns:
+		flag, error, report of the cell
+	"""
+	print("Cell", cell)
+	hierarchical = inputs.get("hierarchical", False)
+	
+	# The layout netlist is handed over in memory, the CDL file is only written for debugging
+	layout_netlist_path = inputs["layout"].split(".")[0] + f"_{cell}.cdl" if inputs.get("write_cdl", False) else None
+	
+	# Skip the extraction if this cell geometry and setup were already extracted
+	# Keys are content hashes, so the cache is shared by every user
+	cache_dir = os.path.join("users", "extraction_cache")
+	key = extraction_key(layout, cell, inputs["layermap"], inputs["config_path"], hierarchical)
+	cached = load_cached(cache_dir, key) if layout_netlist_path is None else None
+	
+	if cached is not None:
+		emit("cache_hit")
+		flag, error, supply, layout_netlist = True, "", cached["supply"], cached["netlist"]
+	else:
+		flag, error, supply, layout_netlist = l2c.layout_to_cdl(inputs["layout"], cell, layout_netlist_path, inputs["layermap"], inputs["config_path"], hierarchical)
+		if flag == True:
+			store_cached(cache_dir, key, layout_netlist, supply)
 
-	# print("LVS Runner called with inputs:", inputs)	
+	if flag == False:
+		print("Error: ", error)
+		emit("cell_error", error = error)
+		return flag, error, ""
+		
+	with stage("source netlist"):
+		source_netlist = load_netlist(inputs["netlist"])
+	
+	#print("source_netlist", source_netlist)
+	#print("\nlayout_netlist", layout_netlist)
+	
+	tol = inputs.get("size_tolerance", SIZE_TOLERANCE)
+	port_var = {cell : {}}
+	dev_var = {cell : {}}
+	size_var = {cell : []}
+	nets_var = {cell : []}
+	opens_var = {cell : {}}
+	shorts_var = {cell : {}}
+	
+	print(source_netlist)
+	print(layout_netlist)
+	print(cell)
+	
+	# The device, size, nets, opens and shorts checks all read one comparison of the cell
+	context = None
+	if any(check == 1 for check in inputs["checks"][1:6]):
+		with stage("netlist matching"):
+			context = cell_context(cell, source_netlist, layout_netlist)
+	
+	if inputs["checks"][0] == 1:
+		with stage("port check"):
+			port_var = port_check_fun(cell, source_netlist, layout_netlist)
+	if inputs["checks"][1] == 1:
+		with stage("device check"):
+			dev_var = dev_nets_checker(cell, source_netlist, layout_netlist, lvs_check = "devices", context = context)
+	if inputs["checks"][2] == 1:
+		with stage("size check"):
+			size_var = size_check_fun(cell, source_netlist, layout_netlist, context = context, tol = tol)
+	if inputs["checks"][3] == 1:
+		with stage("nets check"):
+			nets_var = dev_nets_checker(cell, source_netlist, layout_netlist, lvs_check = "nets", context = context)
+	if inputs["checks"][4] == 1:
+		with stage("opens check"):
+			opens_var = opens_shorts_checker(cell, source_netlist, layout_netlist, lvs_check = "opens", context = context)
+	if inputs["checks"][5] == 1:
+		with stage("shorts check"):
+			shorts_var = opens_shorts_checker(cell, source_netlist, layout_netlist, lvs_check = "shorts", context = context)
+	if inputs["checks"][6] == 1 or inputs["checks"][7] == 1:
+		pass
 
-	for cell in inputs["selected_cells"]:
-		print("Cell", cell)
-		layout_netlist_path = inputs["layout"].split(".")[0] + f"_{cell}.cdl"
-		flag, error, supply = l2c.layout_to_cdl(inputs["layout"], cell, layout_netlist_path, inputs["layermap"], inputs["config_path"])
+	source = inputs["netlist"].split("/")[-1]
+	layout = inputs["layout"].split("/")[-1]
+	
+	var = [port_var, dev_var, size_var, nets_var, opens_var, shorts_var]
+	print("var", var)
+	
+	devices = (len(source_netlist[cell]["devices"]), len(layout_netlist[cell]["devices"]))
+	ports = (len(source_netlist[cell]["ports"]), len(layout_netlist[cell]["ports"]))
+	source_nets = set()
+	layout_nets = set()
+	for d in source_netlist[cell]["devices"]:
+		source_nets.update(d['nets'])
+	for d in layout_netlist[cell]["devices"]:
+		layout_nets.update(d['nets'])
+		
+	source_nets = source_nets - set(source_netlist[cell]["ports"])
+	layout_nets = layout_nets - set(layout_netlist[cell]["ports"])
+	nets = (len(source_nets), len(layout_nets))
+	
+	hierarchy = "Hierarchical" if hierarchical else "Flattened"
+	string = make_report(inputs["username"], cell, source, layout, supply, devices, ports, nets, inputs["checks"], var, hierarchy, tol)
+	
+	return flag, error, string
+	
+#==========================================================================
 
-		if flag == True:
-			source_netlist = parse_netlist(inputs["netlist"])
-			layout_netlist = parse_netlist(layout_netlist_path)
-			
-			#print("source_netlist", source_netlist)
-			#print("\nlayout_netlist", layout_netlist)
-			
-			port_var = {cell : {}}
-			dev_var = {cell : {}}
-			size_var = {cell : []}
-			nets_var = {cell : []}
-			opens_var = {cell : {}}
-			shorts_var = {cell : {}}
-			
-			print(source_netlist)
-			print(layout_netlist)
-			print(cell)
-			if inputs["checks"][0] == 1:
-				port_var = port_check_fun(cell, source_netlist, layout_netlist)
-			if inputs["checks"][1] == 1:
-				dev_var = dev_nets_checker(cell, source_netlist, layout_netlist, lvs_check = "devices")
-			if inputs["checks"][2] == 1:
-				size_var = size_check_fun(cell, source_netlist, layout_netlist)
-			if inputs["checks"][3] == 1:
-				nets_var = dev_nets_checker(cell, source_netlist, layout_netlist, lvs_check = "nets")
-			if inputs["checks"][4] == 1:
-				opens_var = opens_shorts_checker(cell, source_netlist, layout_netlist, lvs_check = "opens")
-			if inputs["checks"][5] == 1:
-				shorts_var = opens_shorts_checker(cell, source_netlist, layout_netlist, lvs_check = "shorts")
-			if inputs["checks"][6] == 1 or inputs["checks"][7] == 1:
-				pass
+def largest_first(layout, cells):
+	"""Orders the cells by their number of shapes (layout is gds_structures), largest first"""
+	_, structures = layout
+	memo = {}
+	size = lambda cell: subtree_shapes(structures, cell, memo) if cell in structures else 0
+	return sorted(cells, key = size, reverse = True)
+	
+#==========================================================================
 
-			source = inputs["netlist"].split("/")[-1]
-			layout = inputs["layout"].split("/")[-1]
-			
-			var = [port_var, dev_var, size_var, nets_var, opens_var, shorts_var]
-			print("var", var)
-			
-			devices = (len(source_netlist[cell]["devices"]), len(layout_netlist[cell]["devices"]))
-			ports = (len(source_netlist[cell]["ports"]), len(layout_netlist[cell]["ports"]))
-			source_nets = set()
-			layout_nets = set()
-			for d in source_netlist[cell]["devices"]:
-				source_nets.update(d['nets'])
-			for d in layout_netlist[cell]["devices"]:
-				layout_nets.update(d['nets'])
-				
-			source_nets = source_nets - set(source_netlist[cell]["ports"])
-			layout_nets = layout_nets - set(layout_netlist[cell]["ports"])
-			nets = (len(source_nets), len(layout_nets))
-			
-			string = make_report(inputs["username"], cell, source, layout, supply, devices, ports, nets, inputs["checks"], var)
-			
-			user_dir = os.path.join("users", inputs["username"])
-			os.makedirs(user_dir, exist_ok=True)
+def lvs_runner(inputs, progress = None):
+	"""
+	Runs LVS on the selected cells and writes one report to inputs["report_path"]
+	(default users/<username>/lvs_report.txt).
+	
+	progress: optional callback(cell, done, total) called as cells finish
+	
+	Stage events (LVS.progress) are only emitted when the cells run 
+	in this process (workers = 1).
+	
+	Returns:
+		{cell: (flag, error, report of the cell)}
+	"""
 
-			report_path = os.path.join(user_dir, "lvs_report.txt")
+	# print("LVS Runner called with inputs:", inputs)	
+	
+	cells = inputs["selected_cells"]
+	workers = min(int(inputs.get("workers", 1)), len(cells), os.cpu_count() or 1)
+	
+	# The records of the layout are scanned once for the cache keys of every cell
+	layout = gds_structures(inputs["layout"])
+	
+	results = {}
+	if workers > 1:
+		# Every cell is independent, the largest ones are started first
+		with ProcessPoolExecutor(max_workers = workers) as pool:
+			futures = {pool.submit(run_cell, inputs, cell, layout): cell for cell in largest_first(layout, cells)}
+			for future in as_completed(futures):
+				results[futures[future]] = future.result()
+				if progress is not None:
+					progress(futures[future], len(results), len(cells))
+	else:
+		for cell in cells:
+			with cell_scope(cell):
+				results[cell] = run_cell(inputs, cell, layout)
+			if progress is not None:
+				progress(cell, len(results), len(cells))
+	
+	# One report, in the order of the selected cells
+	reports = [results[cell][2] for cell in cells if results[cell][0] == True]
+	if reports:
+		user_dir = os.path.join("users", inputs["username"])
+		report_path = inputs.get("report_path", os.path.join(user_dir, "lvs_report.txt"))
+		os.makedirs(os.path.dirname(report_path), exist_ok=True)
 
-			with open(report_path, "w+") as f:
-				f.write(string)
-				f.close()
-		else:
-			print("Error: ", error)
+		with open(report_path, "w+") as f:
+			f.write("\n".join(reports))
+			f.close()
+	
+	return results
 			
 #==========================================================================
 
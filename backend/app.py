@@ -29,6 +29,7 @@ app.config["JWT_COOKIE_SECURE"] = False
 app.config["JWT_COOKIE_SAMESITE"] = "Strict"
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(minutes=30)
 app.config['JWT_REFRESH_TOKEN_EXPIRES'] = timedelta(days=3)
+app.config["LVS_MAX_JOBS"] = 2   # LVS jobs running at the same time
 jwt = JWTManager(app)
 
 
@@ -1,14 +1,11 @@
-import re
 from collections import defaultdict
 import json
 
+from LVS.lvs_checks.parser import iter_subckts
+
 
 def extract_cells(cir):
-	with open(cir, 'r') as f:
-		netlist = f.read()
-		
-	cellnames = re.findall(r"\.SUBCKT\s+(\w+)", netlist, flags=re.IGNORECASE)
-	return cellnames
+	return [name for name, _, _ in iter_subckts(cir)]
 
 #===========================================================================
 	
@@ -19,32 +16,24 @@ def total_cells(cir):
 #===========================================================================	
 
 def extract_metadata(cir):
-    with open(cir) as f:
-        netlist = f.read()
-
-    # Extract all subcircuits
-    subckt_pattern = re.compile(
-        r"\.SUBCKT\s+(\w+)\s+([^\n]+?)\n(.*?)\.ENDS(?:\s+\1)?",
-        re.IGNORECASE | re.DOTALL
-    )
-    
-    subckts = {}
     pins = {}
     instances = defaultdict(list)   # parent → list of (inst_name, child_cell)
 
-    for name, pinlist, body in subckt_pattern.findall(netlist):
-        pins[name] = pinlist.split()
-        subckts[name] = body
-        
-        # Extract instances inside this subckt
-        inst_pattern = re.compile(r"^(X\w*)\s+(.*?)\s+(\w+)$", re.MULTILINE)
-        for inst_name, nodes, cell in inst_pattern.findall(body):
-            instances[name].append((inst_name, cell))
+    # One pass over the logical lines (continuations joined)
+    for name, pinlist, body in iter_subckts(cir):
+        pins[name] = pinlist
+
+        # Instances inside this subckt: X<name> nets... cell [params...]
+        for line in body:
+            if line[0] in "Xx":
+                tokens = line.split()
+                cells = [tok for tok in tokens[1:] if "=" not in tok]
+                if cells:
+                    instances[name].append((tokens[0], cells[-1]))
 
-    # Determine top cell: the one never instantiated
-    all_cells = set(subckts.keys())
+    # Determine top cell: the first one never instantiated
     instantiated = {cell for insts in instances.values() for _, cell in insts}
-    top_cells = list(all_cells - instantiated)
+    top_cells = [cell for cell in pins if cell not in instantiated]
     top = top_cells[0] if top_cells else None
 
     return top, pins, instances
@@ -1,9 +1,9 @@
 from flask import Blueprint, request, jsonify
 import os
-from io import BytesIO
 
 from flask_jwt_extended import get_jwt_identity, jwt_required
 import gdsScan
+from uploads import store_upload, index_upload
 
 gds_bp = Blueprint('gds', __name__)
 
@@ -34,19 +34,18 @@ def get_cellnames():
 	user_dir = os.path.join(os.path.dirname(__file__), 'users', username)
 	os.makedirs(user_dir, exist_ok=True)
 
-	# ✅ Save file in user-specific directory
+	# ✅ Save file in user-specific directory, linked to the shared content store
 	save_path = os.path.join(user_dir, filename)
-	file.save(save_path)
+	sha256 = store_upload(file, save_path)
+	# Layers, labels, boxes and references of every cell, for the scans that follow
+	index_upload(save_path, sha256, gdsScan.writeIndex, gdsScan.INDEX_SUFFIX)
 
 	try:
-		with open(save_path, 'rb') as f:
-			data = f.read()
-
-		data_stream = BytesIO(data)
-
-		unit, precision = gdsScan.getGdsUnits(data_stream)
-		data_stream.seek(0)
-		cell_tree = gdsScan.scanGds(data_stream)		
+		# Only the records of the hierarchy are read, no geometry is built
+		structure = gdsScan.readGdsStream(save_path)
+		unit, precision = structure["unit"], structure["precision"]
+		
+		cell_tree = gdsScan.scanGdsStream(save_path)		
 		
 		cell_names = []
 		cell_names = extract_cell_names(cell_tree, cell_names)
@@ -58,7 +57,8 @@ def get_cellnames():
 			"precision": precision,
 			"cellList": cell_names,
 			"cellTree": cell_tree,
-			"savedPath": f"users/{username}/{filename}"
+			"savedPath": f"users/{username}/{filename}",
+			"sha256": sha256
 		})
 	except Exception as e:
 		return jsonify({"status": "error", "message": str(e)}), 500
@@ -87,15 +87,15 @@ def scan_gds():
 		user_dir = os.path.join(os.path.dirname(__file__), 'users', username)
 		inpGds_path = os.path.join(user_dir,inpGds)
 		
+		# Layers, text layers and labels in a single pass over the records
+		layers, text_layers, labels = gdsScan.scanInventory(inpGds_path, [])
+		
 		if layer_type in ['layers', 'both']:
-			layers = gdsScan.getLayer_fromGds(inpGds_path, [], precision, unit)
 			response_data['layers'] = layers
 
 		if layer_type in ['text_layers', 'both']:
-			text_layers = gdsScan.getTextLayer_fromGds(inpGds_path, [], precision, unit)
 			response_data['text_layers'] = text_layers
 
-		labels = gdsScan.getLabels_fromGds(inpGds_path, [], precision, unit)
 		response_data['labels'] = labels
 
 		response_data['unit'] = unit
@@ -1,16 +1,15 @@
 from collections import defaultdict
 from .geometry_utils import *
-from shapely.geometry import LineString, MultiLineString
+from shapely.strtree import STRtree
+
+NO_DEVICE = "No Device Found. Cannot Execute LVS"
+FLOATING_DEVICE = "Floating Devices Found. Cannot Execute LVS"
 
 #----------------------------------------------------------------
 		
 def add_to_cell(cell, shapes, layer, dbu):
 	new_shapes = boolean_or(shapes, shapes, dbu, (layer[0], layer[1]))
-	delete(cell, shapes)
-	for p in new_shapes.polygons:
-		cell.add(gdspy.Polygon(p, layer = layer[0], datatype = layer[1]))
-	
-	return cell
+	return replace_layer(cell, layer, new_shapes.polygons)
 	
 #----------------------------------------------------------------	
 	
@@ -30,7 +29,32 @@ def polygon_oring(cell, polygons, stack, dbu):
 	
 #----------------------------------------------------------------			
 
-def base_layer_ops(cell, polygons, layermap, dbu):
+def polygons_of(result, strict = True):
+	"""
+	Polygons of a gdspy boolean result. An empty result (None) 
+	raises in strict mode and gives no polygons otherwise
+	"""
+	if result is None and not strict:
+		return []
+	return result.polygons
+	
+#----------------------------------------------------------------			
+
+def skipped(strict, *layers):
+	"""
+	Outside strict mode, a boolean with an empty input layer (no polygons 
+	or an empty result) is skipped: it has no shapes and gdspy raises on it
+	"""
+	return not strict and any(layer is None or (isinstance(layer, list) and len(layer) == 0) for layer in layers)
+	
+#----------------------------------------------------------------			
+
+def base_layer_ops(cell, polygons, layermap, dbu, strict = True):
+	"""
+	Derives the device layers (diff not poly, gates, bulk taps).
+	With strict = False, missing device types or taps are not errors,
+	which is the case for a tile of a larger cell.
+	"""
 	poly_shapes = polygons.get(layermap[("poly", "drawing")], [])
 	diff_shapes = polygons.get(layermap[("diff", "drawing")], [])
 	pp_shapes = polygons.get(layermap[("pp", "drawing")], [])
@@ -40,64 +64,70 @@ def base_layer_ops(cell, polygons, layermap, dbu):
 	error = ""
 	
 	try:
-		diff_not_poly = boolean_not(diff_shapes, poly_shapes, dbu, layermap[("diff", "drawing")])
-		layer = layermap[("diff", "drawing")]
-		for p in diff_not_poly.polygons:
-			cell.add(gdspy.Polygon(p, layer = layer[0], datatype = layer[1]))
+		diff_not_poly = None if skipped(strict, diff_shapes) else boolean_not(diff_shapes, poly_shapes, dbu, layermap[("diff", "drawing")])
+		cell = replace_layer(cell, layermap[("diff", "drawing")], polygons_of(diff_not_poly, strict))
 		
-		gate = boolean_and(diff_shapes, poly_shapes, dbu, (1001,0))
-		pmos = boolean_and(gate, pp_shapes, dbu, (1002,0))
-		nmos = boolean_and(gate, np_shapes, dbu, (1003,0))
+		gate = None if skipped(strict, diff_shapes, poly_shapes) else boolean_and(diff_shapes, poly_shapes, dbu, (1001,0))
+		pmos = None if skipped(strict, gate, pp_shapes) else boolean_and(gate, pp_shapes, dbu, (1002,0))
+		nmos = None if skipped(strict, gate, np_shapes) else boolean_and(gate, np_shapes, dbu, (1003,0))
 		
-		for p in pmos.polygons:
+		for p in polygons_of(pmos, strict):
 			cell.add(gdspy.Polygon(p, layer = 1002, datatype = 0))
-		for p in nmos.polygons:
+		for p in polygons_of(nmos, strict):
 			cell.add(gdspy.Polygon(p, layer = 1003, datatype = 0))
 	except:
 		flag = False
-		error = "No Device Found. Cannot Execute LVS"
+		error = NO_DEVICE
 		return flag, cell, error
 
 	try:
-		pdiff = boolean_and(diff_shapes, pp_shapes, dbu , (1004,0))
-		ndiff = boolean_and(diff_shapes, np_shapes, dbu, (1005,0))
-		pbody = boolean_and(ndiff, nw_shapes, dbu, (1006,0))
-		nbody = boolean_not(pdiff, nw_shapes, dbu, (1007,0))
+		pdiff = None if skipped(strict, diff_shapes, pp_shapes) else boolean_and(diff_shapes, pp_shapes, dbu , (1004,0))
+		ndiff = None if skipped(strict, diff_shapes, np_shapes) else boolean_and(diff_shapes, np_shapes, dbu, (1005,0))
+		pbody = None if skipped(strict, ndiff, nw_shapes) else boolean_and(ndiff, nw_shapes, dbu, (1006,0))
+		nbody = None if skipped(strict, pdiff) else boolean_not(pdiff, nw_shapes, dbu, (1007,0))
 		
-		delete(cell, diff_shapes)
-		for p in nbody.polygons:
+		for p in polygons_of(nbody, strict):
 			cell.add(gdspy.Polygon(p, layer = 1006, datatype = 0))
-		for p in pbody.polygons:
+		for p in polygons_of(pbody, strict):
 			cell.add(gdspy.Polygon(p, layer = 1007, datatype = 0))
 	except:
 		flag = False
-		error = "Floating Devices Found. Cannot Execute LVS"
+		error = FLOATING_DEVICE
 	
 	return flag, cell, error
 	
 #----------------------------------------------------------------			
 
-def find_edge_sharing(l1, l2, dbu):
+def find_edge_sharing(l1, l2, store):
 	"""
 	Find polygons from l1 that share an edge with polygons in l2.
 	
+	Each polygon is converted once through the GeometryStore. Neighbours are found through an STRtree
+	over l2, Manhattan pairs are compared through their axis edge hashes and
+	only non-Manhattan pairs fall back to the exact shapely test.
+	
 	Returns:
 		dict where key = gdspy.Polygon (poly layer), 
 			 value = list of polygons from l2 sharing an edge (diff layer)
 	"""
+	shapes2 = [store.shape(poly2) for poly2 in l2]
+	edges2 = [store.axis_edges(poly2) for poly2 in l2]
+	tree = STRtree(shapes2)
+	
 	devmap = {}
 	for poly1 in l1:
-		shapely_poly1 = gdspy_to_shapely(poly1, dbu)
+		shapely_poly1 = store.shape(poly1)
+		edges1 = store.axis_edges(poly1)
 		
 		neighbors = []
-		for poly2 in l2:
-			shapely_poly2 = gdspy_to_shapely(poly2, dbu)
-			
-			inter = shapely_poly1.boundary.intersection(shapely_poly2.boundary)
+		for idx in sorted(tree.query(shapely_poly1)):
+			if edges1 is not None and edges2[idx] is not None:
+				shared = share_axis_edge(edges1, edges2[idx])
+			else:
+				shared = share_edge(shapely_poly1, shapes2[idx])
 
-			# Check if intersection is a line (shared edge)
-			if ((isinstance(inter, LineString) or isinstance(inter, MultiLineString)) and inter.length > 0):
-				neighbors.append(poly2)
+			if shared:
+				neighbors.append(l2[idx])
 
 		if neighbors:
 			devmap[poly1] = neighbors
@@ -105,28 +135,27 @@ def find_edge_sharing(l1, l2, dbu):
 	return devmap
 
 #----------------------------------------------------------------			
-def get_supply(polygons, layermap, netmap):
+def get_supply(polygons, layermap, netmap, store):
 	supply = {}
 	for diff in polygons.get(layermap[("diff", "drawing")], []):
 		for bulk1 in polygons.get((1006,0), []):
-			if overlap(diff, bulk1):
+			if store.overlap(diff, bulk1):
 				supply["NMOS"] = netmap[diff]
 				
 		for bulk2 in polygons.get((1007,0), []):
-			if overlap(diff, bulk2):
+			if store.overlap(diff, bulk2):
 				supply["PMOS"] = netmap[diff]
 				
 	return supply
 
 #----------------------------------------------------------------			
 
-def find_properties(netmap, devmap, model, supply, dbu):
-	nfinger = defaultdict(int) 
-	width = defaultdict(float)
-	length = defaultdict(float)
-	
-	supply_nets = list(supply.values())
-	
+def device_records(netmap, devmap, store):
+	"""
+	Returns (gate_net, src_net, drn_net, length, area) for every gate 
+	of devmap with exactly two terminals
+	"""
+	records = []
 	for gate, terminals in devmap.items():
 		if not isinstance(terminals, (list, tuple)) or len(terminals) != 2:
 			continue  # skip invalid entries
@@ -138,6 +167,21 @@ def find_properties(netmap, devmap, model, supply, dbu):
 		src_net = netmap.get(source, "UNCONNECTED")
 		drn_net = netmap.get(drain, "UNCONNECTED")
 		
+		records.append((gate_net, src_net, drn_net, cal_length(source, drain, store, 0), cal_area(gate, store)))
+		
+	return records
+
+#----------------------------------------------------------------			
+
+def aggregate_devices(records, model, supply, dbu):
+	"""Merges device records into fingers, total width and length per device"""
+	nfinger = defaultdict(int) 
+	width = defaultdict(float)
+	length = defaultdict(float)
+	
+	supply_nets = list(supply.values())
+	
+	for gate_net, src_net, drn_net, dev_len, area in records:
 		if drn_net in supply_nets:
 			key = (src_net, gate_net, drn_net, supply[model], model)
 		elif src_net in supply_nets:
@@ -148,19 +192,25 @@ def find_properties(netmap, devmap, model, supply, dbu):
 			key = (drn_net, gate_net, src_net, supply[model], model)
 		
 		nfinger[key] += 1
-		length[key] = cal_length(source, drain, dbu, length[key])
-		w = cal_area(gate, dbu)/length[key]
+		length[key] = min(length[key], dev_len) if length[key] != 0 else dev_len
+		w = area/length[key]
 		width[key] += round_coords(w, dbu)
 		
 	return nfinger, width, length
 
+#----------------------------------------------------------------			
+
+def find_properties(netmap, devmap, model, supply, store):
+	records = device_records(netmap, devmap, store)
+	return aggregate_devices(records, model, supply, store.dbu)
+
 #----------------------------------------------------------------	
 
-def cal_length(source, drain, dbu, prev_len):
-	s = gdspy_to_shapely(source, dbu)
-	d = gdspy_to_shapely(drain, dbu)
+def cal_length(source, drain, store, prev_len):
+	s = store.shape(source)
+	d = store.shape(drain)
 	length = s.distance(d)
-	length = round_coords(length, dbu)
+	length = round_coords(length, store.dbu)
 	if prev_len!=0:
 		return min(prev_len, length)
 	else:
@@ -168,7 +218,7 @@ def cal_length(source, drain, dbu, prev_len):
 	
 #----------------------------------------------------------------
 
-def cal_area(gate, dbu):
-	g = gdspy_to_shapely(gate, dbu)
-	return round_coords(g.area, dbu)
+def cal_area(gate, store):
+	g = store.shape(gate)
+	return round_coords(g.area, store.dbu)
 	
@@ -1,11 +1,20 @@
 import gdspy
 import numpy
-from shapely.geometry import Polygon
+from collections import defaultdict
+from shapely.geometry import Polygon, LineString, MultiLineString, box
+from shapely.strtree import STRtree
 
 # ===============================================================
 # GDSPY Common Polygon Functions
 # ===============================================================
 
+# Results are used for extraction, not written to GDSII: polygons 
+# are never fractured, as fractured pieces would only abut and 
+# lose their connectivity
+MAX_POINTS = 0
+
+#----------------------------------------------------------------		
+
 def overlap(poly1: gdspy.Polygon, poly2: gdspy.Polygon) -> bool:
 	"""Check if two polygons overlap."""
 	return gdspy.boolean(poly1, poly2, "and") is not None
@@ -19,6 +28,7 @@ def boolean_or(poly1, poly2, precision, layer):
 						 poly2, 
 						 "or", 
 						 precision, 
+						 max_points = MAX_POINTS,
 						 layer = layer[0], 
 						 datatype = layer[1])
 
@@ -31,6 +41,7 @@ def boolean_not(poly1, poly2, precision, layer):
 						 poly2, 
 						 "not", 
 						 precision, 
+						 max_points = MAX_POINTS,
 						 layer = layer[0], 
 						 datatype = layer[1])
 
@@ -43,17 +54,53 @@ def boolean_and(poly1, poly2, precision, layer):
 						 poly2, 
 						 "and", 
 						 precision, 
+						 max_points = MAX_POINTS,
 						 layer = layer[0], 
 						 datatype = layer[1])
 
 #----------------------------------------------------------------	
 
-def delete(cell, polygons):
-	"""Deletes the polygon from the cell"""
-	for poly in polygons:
-		layer = poly.layers[0]
-		dtype = poly.datatypes[0]
-		cell.remove_polygons(lambda pts, l, d: len(poly.polygons)!=0 and numpy.array_equal(pts,poly.polygons[0]) and l == layer and d == dtype )	
+def replace_layer(cell, layer, polygons):
+	"""
+	Replaces all the shapes on layer (layer, datatype) of the cell 
+	with the given polygons (list of points) in a single pass
+	"""
+	cell.polygons = [p for p in cell.polygons if (p.layers[0], p.datatypes[0]) != layer]
+	for pts in polygons:
+		cell.polygons.append(gdspy.Polygon(pts, layer = layer[0], datatype = layer[1]))
+	return cell
+
+# ===============================================================
+# Spatial Index
+# ===============================================================
+
+def bounding_box(poly):
+	"""Returns the bounding box of a gdspy.Polygon as a shapely box"""
+	bb = poly.get_bounding_box()
+	if bb is None:
+		return None
+	return box(bb[0][0], bb[0][1], bb[1][0], bb[1][1])
+
+#----------------------------------------------------------------	
+
+class SpatialIndex:
+	"""
+	STRtree over the bounding boxes of the polygons of one layer.
+	Used as a prefilter so that exact polygon tests are only run 
+	on pairs whose extents touch.
+	"""
+	def __init__(self, polygons):
+		self.polygons = polygons
+		self.boxes = [bounding_box(poly) for poly in polygons]
+		self.tree = STRtree([b if b is not None else box(0, 0, 0, 0) for b in self.boxes])
+
+	def candidates(self, poly):
+		"""Returns the polygons whose bounding box touches that of poly, in layer order"""
+		bb = bounding_box(poly)
+		if bb is None:
+			return []
+		idx = sorted(self.tree.query(bb))
+		return [self.polygons[i] for i in idx if self.boxes[i] is not None]
 
 		
 # ===============================================================
@@ -68,5 +115,138 @@ def gdspy_to_shapely(gdspy_polygon, dbu):
 	"""Convert gdspy.Polygon to shapely.Polygon."""
 	pts = round_coords(gdspy_polygon.polygons[0], dbu)
 	return Polygon(pts)
+	
+#----------------------------------------------------------------	
+
+def transform_points(pts, ref, spacing=(0, 0)):
+	"""
+	Applies the transformation of a gdspy CellReference / CellArray
+	(array offset, magnification, x reflection, rotation, origin) to points
+	"""
+	pts = numpy.array(pts, dtype = float)
+	if ref.magnification is not None:
+		pts = pts * ref.magnification
+	pts = pts + numpy.array(spacing, dtype = float)
+	if ref.x_reflection:
+		pts = pts * numpy.array((1, -1))
+	if ref.rotation is not None:
+		ct = numpy.cos(ref.rotation * numpy.pi / 180.0)
+		st = numpy.sin(ref.rotation * numpy.pi / 180.0)
+		pts = numpy.stack((pts[:, 0] * ct - pts[:, 1] * st, pts[:, 0] * st + pts[:, 1] * ct), axis = 1)
+	if ref.origin is not None:
+		pts = pts + numpy.array(ref.origin)
+	return pts
+	
+#----------------------------------------------------------------	
+
+def to_dbu(pts, dbu):
+	"""Converts coordinates to integer database units"""
+	return numpy.round(pts / dbu).astype(numpy.int64).tolist()
+	
+# ===============================================================
+# Geometry Store
+# ===============================================================	
+
+class GeometryStore:
+	"""
+	Per-run cache of the derived geometry of gdspy.Polygon objects.
+	Integer coordinates (dbu), bounding box, shapely polygon and axis 
+	edge hash are each built once per polygon and shared by all the 
+	stages of an extraction run.
+	"""
+	def __init__(self, dbu):
+		self.dbu = dbu
+		self.coords = {}
+		self.boxes = {}
+		self.shapes = {}
+		self.edges = {}
+
+	def points(self, poly):
+		"""Integer coordinates of the polygon"""
+		if poly not in self.coords:
+			self.coords[poly] = to_dbu(poly.polygons[0], self.dbu)
+		return self.coords[poly]
+
+	def bbox(self, poly):
+		"""Bounding box (xmin, ymin, xmax, ymax) in integer coordinates"""
+		if poly not in self.boxes:
+			pts = numpy.array(self.points(poly))
+			xmin, ymin = pts.min(axis = 0).tolist()
+			xmax, ymax = pts.max(axis = 0).tolist()
+			self.boxes[poly] = (xmin, ymin, xmax, ymax)
+		return self.boxes[poly]
+
+	def shape(self, poly):
+		"""shapely.Polygon of the polygon"""
+		if poly not in self.shapes:
+			self.shapes[poly] = gdspy_to_shapely(poly, self.dbu)
+		return self.shapes[poly]
+
+	def axis_edges(self, poly):
+		"""Axis edge hash of the polygon, None if not Manhattan"""
+		if poly not in self.edges:
+			self.edges[poly] = axis_edges(self.points(poly))
+		return self.edges[poly]
+
+	def overlap(self, poly1, poly2):
+		"""Check if two polygons overlap with a non-zero area"""
+		b1 = self.bbox(poly1)
+		b2 = self.bbox(poly2)
+		if b1[2] <= b2[0] or b2[2] <= b1[0] or b1[3] <= b2[1] or b2[3] <= b1[1]:
+			return False
+		s1 = self.shape(poly1)
+		s2 = self.shape(poly2)
+		return s1.intersects(s2) and not s1.touches(s2)
+
+	def clear(self):
+		self.coords.clear()
+		self.boxes.clear()
+		self.shapes.clear()
+		self.edges.clear()
+		
+# ===============================================================
+# Edge Sharing
+# ===============================================================	
+
+def axis_edges(pts):
+	"""
+	Hashes the edges of a polygon (integer coordinates) by the line they lie on.
+	
+	Returns:
+		None if the polygon is not Manhattan, else
+		dict: {("h", y) / ("v", x): [(lo, hi), ...]}
+	"""
+	edges = defaultdict(list)
+	n = len(pts)
+	for i in range(n):
+		x1, y1 = pts[i]
+		x2, y2 = pts[(i + 1) % n]
+		if x1 == x2 and y1 == y2:
+			continue
+		elif y1 == y2:
+			edges[("h", y1)].append((min(x1, x2), max(x1, x2)))
+		elif x1 == x2:
+			edges[("v", x1)].append((min(y1, y2), max(y1, y2)))
+		else:
+			return None
+	return edges
+
+#----------------------------------------------------------------	
+
+def share_axis_edge(edges1, edges2):
+	"""Checks if two Manhattan polygons have a collinear edge overlap of non-zero length"""
+	for key, spans2 in edges2.items():
+		for lo1, hi1 in edges1.get(key, []):
+			for lo2, hi2 in spans2:
+				if min(hi1, hi2) - max(lo1, lo2) > 0:
+					return True
+	return False
+
+#----------------------------------------------------------------	
+
+def share_edge(shapely_poly1, shapely_poly2):
+	"""Checks if the boundaries of two shapely polygons intersect in a line"""
+	inter = shapely_poly1.boundary.intersection(shapely_poly2.boundary)
+	return (isinstance(inter, LineString) or isinstance(inter, MultiLineString)) and inter.length > 0
 	 
 
@@ -1,5 +1,5 @@
 import itertools
-from .geometry_utils import overlap
+from .geometry_utils import overlap, SpatialIndex
 
 
 
@@ -38,6 +38,15 @@ def merge(lower, upper):
 
 #----------------------------------------------------------------		
 
+def flatten_stack(stack):
+	"""Returns the layers of the stack as a single list, bottom first"""
+	layers = []
+	for item in stack:
+		layers.extend(item if isinstance(item, list) else [item])
+	return layers
+
+#----------------------------------------------------------------		
+
 def validate_pairs(lay1, lay2, checked):
 	"""Checks if lay1 and lay2 are already connected via recursive_connect function"""
 	
@@ -50,7 +59,15 @@ def validate_pairs(lay1, lay2, checked):
 		
 #----------------------------------------------------------------		
 
-def recursive_connect(uf, stack, polygons, netmap, current_layer, ports, checked = {}):
+def get_index(index, polygons, layer):
+	"""Returns the spatial index of a layer, building it on first use"""
+	if layer not in index:
+		index[layer] = SpatialIndex(polygons[layer])
+	return index[layer]
+
+#----------------------------------------------------------------		
+
+def recursive_connect(uf, stack, polygons, netmap, current_layer, ports, checked = None, index = None):
 	"""
 	Recursively explore layer connectivity across adjacent layers.
 
@@ -61,10 +78,16 @@ def recursive_connect(uf, stack, polygons, netmap, current_layer, ports, checked
 		netmap: dict: {gdspy.Polygon: label.text}
 		current_layer: Starting layer for connectivity
 		checked: Pairs for which connectivity is checked
+		index: Spatial index per layer, shared across the recursion
 
 	Returns:
 		dict: {gdspy.Polygon: label.text}
 	"""
+	if checked is None:
+		checked = {}
+	if index is None:
+		index = {}
+		
 	current_polys = polygons[current_layer]
 	if current_layer not in checked.keys():
 		checked[current_layer] = []
@@ -77,9 +100,9 @@ def recursive_connect(uf, stack, polygons, netmap, current_layer, ports, checked
 	
 	for layer in layers:
 		if layer is not None and validate_pairs(current_layer, layer, checked) and layer in polygons:
-			stack_polys = polygons[layer]
+			stack_index = get_index(index, polygons, layer)
 			for each1 in current_polys:
-				for each2 in stack_polys:
+				for each2 in stack_index.candidates(each1):
 					if overlap(each1, each2):
 						root1 = uf.find(netmap[each1])
 						root2 = uf.find(netmap[each2])
@@ -104,7 +127,7 @@ def recursive_connect(uf, stack, polygons, netmap, current_layer, ports, checked
 			else:
 				checked[layer].append(current_layer)
 				
-			recursive_connect(uf, stack, polygons, netmap, layer, ports, checked)
+			recursive_connect(uf, stack, polygons, netmap, layer, ports, checked, index)
 			
 	return netmap
 	
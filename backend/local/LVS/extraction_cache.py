@@ -0,0 +1,142 @@
+import os
+import json
+import mmap
+import hashlib
+
+import gdsScan
+
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+
+# Part of every key, changed when the stored entry changes
+CACHE_VERSION = b"2"
+
+#==========================================================================
+
+def gds_structures(gds_path):
+	"""
+	Scans the GDSII records once through a memory map, without building the 
+	geometry (or reads the sidecar index of the layout when it is up to date).
+	Called once per run, the result is handed to extraction_key.
+
+	Returns:
+		units (bytes), dict: {cellname: (sha256 of the cell records, [referenced cells], number of shapes)}
+	"""
+	index = gdsScan.loadIndex(gds_path)
+	if index is not None:
+		return bytes.fromhex(index["units"]), {
+			name: (cell["digest"], [child for child, _ in cell["refs"]], sum(cell["shapes"].values()))
+			for name, cell in index["cells"].items()
+		}
+
+	if os.stat(gds_path).st_size == 0:
+		return b"", {}
+	with open(gds_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+		structure = gdsScan.indexStructure(buf)
+
+	return structure["units"], {
+		name: (cell["digest"], [ref["sname"] for ref in cell["refs"]], sum(cell["shapes"].values()))
+		for name, cell in structure["cells"].items() if "digest" in cell
+	}
+
+#==========================================================================
+
+def subtree_digest(structures, cellname, memo = None):
+	"""Hash of a cell and of every cell below it"""
+	if memo is None:
+		memo = {}
+	if cellname not in memo:
+		own, children, _ = structures[cellname]
+		digest = hashlib.sha256(own.encode())
+		for child in sorted(set(children)):
+			if child in structures:
+				digest.update(subtree_digest(structures, child, memo).encode())
+		memo[cellname] = digest.hexdigest()
+	return memo[cellname]
+
+#==========================================================================
+
+def subtree_shapes(structures, cellname, memo = None):
+	"""Number of shapes of a cell with every reference expanded once (arrays count as one placement)"""
+	if memo is None:
+		memo = {}
+	if cellname not in memo:
+		_, children, shapes = structures[cellname]
+		memo[cellname] = shapes + sum(subtree_shapes(structures, child, memo) for child in children if child in structures)
+	return memo[cellname]
+
+#==========================================================================
+
+def extraction_key(layout, cellname, layermap, config_path, hierarchical = False):
+	"""
+	Key of an extraction: the geometry of the cell subtree, the
+	layermap and config contents and the extraction mode.
+	layout is gds_structures of the layout.
+	Returns None if the cell is not in the layout.
+	"""
+	units, structures = layout
+	if cellname not in structures:
+		return None
+
+	digest = hashlib.sha256(CACHE_VERSION)
+	digest.update(units)
+	digest.update(subtree_digest(structures, cellname).encode())
+	for path in (layermap, config_path):
+		with open(path, "rb") as f:
+			digest.update(hashlib.sha256(f.read()).digest())
+	digest.update(f"{cellname}:{hierarchical}".encode())
+	return digest.hexdigest()
+
+#==========================================================================
+
+def load_cached(cache_dir, key):
+	"""Returns the cached {netlist, supply} of key or None. A hit marks the entry as recently used"""
+	if key is None:
+		return None
+
+	path = os.path.join(cache_dir, key + ".json")
+	try:
+		with open(path, "r") as f:
+			entry = json.load(f)
+		os.utime(path)
+	except (OSError, ValueError):
+		return None
+	return entry
+
+#==========================================================================
+
+def store_cached(cache_dir, key, netlist, supply, max_bytes = MAX_CACHE_BYTES):
+	"""Stores an extraction result and evicts the least recently used entries"""
+	if key is None:
+		return
+
+	os.makedirs(cache_dir, exist_ok=True)
+	path = os.path.join(cache_dir, key + ".json")
+	tmp_path = path + f".{os.getpid()}.tmp"
+	with open(tmp_path, "w") as f:
+		json.dump({"netlist": netlist, "supply": supply}, f)
+	os.replace(tmp_path, path)
+
+	evict(cache_dir, max_bytes)
+
+#==========================================================================
+
+def evict(cache_dir, max_bytes = MAX_CACHE_BYTES):
+	"""Removes the least recently used entries until the cache fits in max_bytes"""
+	entries = []
+	for name in os.listdir(cache_dir):
+		if name.endswith(".json"):
+			try:
+				stat = os.stat(os.path.join(cache_dir, name))
+			except OSError:
+				continue
+			entries.append((stat.st_mtime, stat.st_size, name))
+
+	total = sum(size for _, size, _ in entries)
+	for mtime, size, name in sorted(entries):
+		if total <= max_bytes:
+			break
+		try:
+			os.remove(os.path.join(cache_dir, name))
+		except OSError:
+			pass
+		total -= size
@@ -0,0 +1,76 @@
+from collections import defaultdict
+
+from .graph_match import match_netlists, device_kind
+
+#==========================================================================
+
+def nets_of(sub):
+	"""Nets of a subcircuit in order of appearance, ports first"""
+	nets = dict.fromkeys(sub["ports"])
+	for d in sub["devices"]:
+		nets.update(dict.fromkeys(d["nets"]))
+	return list(nets)
+
+#==========================================================================
+
+def pins_by_name(sub, source_netlist, layout_netlist):
+	"""
+	Copy of a layout subcircuit whose X instances list their nets in the port 
+	order of the schematic subcircuit they place, as subcircuit pins are matched
+	by position. Instances of cells whose port names differ are left as is.
+	"""
+	devices = []
+	for d in sub["devices"]:
+		model = d["model"]
+		if d["type"] == "X" and model in source_netlist and model in layout_netlist:
+			ports1 = source_netlist[model]["ports"]
+			ports2 = layout_netlist[model]["ports"]
+			if sorted(ports1) == sorted(ports2) and len(ports2) == len(d["nets"]):
+				nets = dict(zip(ports2, d["nets"]))
+				d = {**d, "nets": [nets[port] for port in ports1]}
+		devices.append(d)
+	return {**sub, "devices": devices}
+
+#==========================================================================
+
+class CellContext:
+	"""
+	Comparison of one cell, built once and read by every check: the device
+	kinds, the nets, the device/net correspondence of the two netlists and
+	the net connectivity it implies (sub1 is the schematic, sub2 the layout).
+	"""
+	def __init__(self, sub1, sub2):
+		self.sub1 = sub1
+		self.sub2 = sub2
+		self.kinds1 = [device_kind(d) for d in sub1["devices"]]
+		self.kinds2 = [device_kind(d) for d in sub2["devices"]]
+		self.nets1 = nets_of(sub1)
+		self.nets2 = nets_of(sub2)
+
+		self.match = match_netlists(sub1, sub2)
+		self.devices = self.match["devices"]			# schematic device -> layout device
+		self.net_map = self.match["nets"]				# schematic net -> layout net
+		self.unmatched = self.match["unmatched"]		# (schematic devices, layout devices)
+		self.guessed = self.match["guessed"]			# schematic devices paired without a shared net
+
+		# (schematic device, schematic net, layout net) for every terminal of the matched devices
+		self.terminals = []
+		for i, j in self.devices.items():
+			nets2 = sub2["devices"][j]["nets"]
+			for net1, k in zip(sub1["devices"][i]["nets"], self.match["orientation"][i]):
+				self.terminals.append((i, net1, nets2[k]))
+
+		# Layout nets reached by each schematic net and the reverse
+		self.connects1 = defaultdict(set)
+		self.connects2 = defaultdict(set)
+		for _, net1, net2 in self.terminals:
+			self.connects1[net1].add(net2)
+			self.connects2[net2].add(net1)
+
+#==========================================================================
+
+def cell_context(cellname, source_netlist, layout_netlist):
+	"""Context of a cell present in both netlists, otherwise None"""
+	if cellname in source_netlist and cellname in layout_netlist:
+		return CellContext(source_netlist[cellname], pins_by_name(layout_netlist[cellname], source_netlist, layout_netlist))
+	return None
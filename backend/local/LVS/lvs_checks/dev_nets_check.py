@@ -1,6 +1,8 @@
 import re
 import json
-from collections import defaultdict
+from collections import defaultdict, Counter
+
+from .context import CellContext
 
 def normalize_model(model):
 	m = model.lower()
@@ -10,175 +12,85 @@ def normalize_model(model):
 
 #==========================================================================
 
-def canonicalize_devices(ports, devlist):
-	"""
-	Canonicalize MOSFET devices in a topology-based,
-	order-independent way.
-	"""
-	port_set = set(ports)
-
-	# 1. Build connectivity signature for each internal net
-	net_connections = defaultdict(list)
-
-	for d in devlist:
-		for num, role in enumerate(["d", "g", "s", "b"]):
-			net = d["nets"][num]
-			if net not in port_set:
-				# Store type + role (D/G/S/B) for grouping
-				net_connections[net].append((normalize_model(d["model"]), role))
-
-	# 2. Assign deterministic IDs based on sorted connectivity signatures
-	internal_map = {}
-	for idx, (net, conn) in enumerate(
-		sorted(net_connections.items(), key=lambda x: sorted(x[1]))
-	):
-		internal_map[net] = f"INT_{idx+1}"
-
-	# 3. Convert each device into canonical signature
-	def map_net(n):
-		if n in port_set:
-			return f"PORT_{n}"
-		return internal_map[n]
-		
-	canonical = []
-	for d in devlist:
-		D = map_net(d["nets"][0])
-		G = map_net(d["nets"][1])
-		S = map_net(d["nets"][2])
-		B = map_net(d["nets"][3])
-
-		# Device signature is order-independent by sorting nets
-		signature = (
-			normalize_model(d["model"]),
-			tuple([D, G, S, B]),
-			d["inst"],
-			tuple(d["nets"])
-		)
-		canonical.append(signature)
-
-	# Sort entire device list for final canonical form
-	canonical.sort()
-	return canonical
-
-#==========================================================================
-
 
 # -------------------------------------------------
 # Compare two subcircuits for nets mismatch
 # -------------------------------------------------
 
-def nets_check_fun(sub1, sub2):
-	sig1 = canonicalize_devices(sub1["ports"], sub1["devices"])
-	sig2 = canonicalize_devices(sub2["ports"], sub2["devices"])
-
-#	print("sig1", sig1)
-#	print("\nsig2", sig2)
+def nets_check_fun(sub1, sub2, context = None):
+	"""
+	Nets that the device correspondence does not carry over: for every pair 
+	of matched devices, the terminals whose (mapped) schematic net does not
+	map to the net of the layout terminal; then, once each, the nets left 
+	without a counterpart.
+	"""
+	if context is None:
+		context = CellContext(sub1, sub2)
+	net_map = context.net_map
+	
+	mismatch = []
+	reported2 = set()
+	for _, net1, net2 in context.terminals:
+		if net1 in net_map and net_map[net1] != net2 and net1 != net2:
+			mismatch.append((net1, net2))
+			reported2.add(net2)
+	
+	mapped2 = set(net_map.values())
+	for net1 in context.nets1:
+		if net1 not in net_map:
+			mismatch.append((net1, None))
+	for net2 in context.nets2:
+		if net2 not in mapped2 and net2 not in reported2:
+			mismatch.append((None, net2))
+	
+	return list(dict.fromkeys(mismatch))
 	
-	if [s1[:2] for s1 in sig1] == [s2[:2] for s2 in sig2]:
-		return {}
-	else:
-		diff = { "Schematic" : [], "Layout" : []}
-		s2_matched = []
-		for s1 in sig1:
-			flag = 0
-			for s2 in sig2:
-				if s1[:2] == s2[:2]:
-					flag = 1
-					s2_matched.append(s2)
-				elif s1[0] == s2[0]:
-					if s1[1][1] == s2[1][1] and s1[1][3] == s2[1][3]:
-						if s1[1][0] == s2[1][2] and s1[1][2] == s2[1][0]:
-							flag = 1
-							s2_matched.append(s2)
-			if flag == 0:
-				diff["Schematic"].append(s1)
-			
-		diff["Layout"] = [s for s in sig2 if s not in s2_matched]
-		#print("diff", diff)
-		
-		count = {}
-		for dev1 in diff["Schematic"]:
-			for dev2 in diff["Layout"]:
-				if dev1[0] ==  dev2[0]:
-					count[(dev1, dev2)] = 0
-					for i in range(len(dev1[1])):
-						if dev1[1][i] == dev2[1][i]:
-							count[(dev1, dev2)]+=1
-						else:
-							j = 2 if i == 0 else (0 if i == 2 else i)
-							if dev1[1][i] == dev2[1][j]:
-								count[(dev1, dev2)]+=1
-		
-		count = dict(sorted(count.items(), key = lambda x: x[1], reverse=True))
-		
-		mismatch = []
-		dev_matched = []
-		error_nets = []
-		for key in count.keys():
-			if key[0] not in dev_matched and key[1] not in dev_matched:
-				if count[key] > 0:
-					dev1 = key[0]
-					dev2 = key[1]
-					dev_matched.append(key[0])
-					dev_matched.append(key[1])
-					for i in range(len(dev1[1])):
-						#print("i", i, dev1[1][i], dev2[1][i])
-						if dev1[1][i] != dev2[1][i]:
-							j = 2 if i == 0 else (0 if i == 2 else i)
-							#print("j", j, dev1[1][i], dev2[1][j], dev1[1][j], dev2[1][j])
-							if dev1[1][i] != dev2[1][j] and dev1[1][j] != dev2[1][j]:
-								mismatch.append((dev1[3][i], dev2[3][j]))
-								error_nets.extend([dev1[3][i], dev2[3][j]])
-							elif dev1[1][i] != dev2[1][j]:
-								mismatch.append((dev1[3][i], dev2[3][i]))
-								error_nets.extend([dev1[3][i], dev2[3][i]])
-							
-							
-				else:
-					for p in dev1[1]:
-						if p not in error_nets:
-							mismatch.append((p, None)) 
-					
-					for p in dev2[1]:
-						if p not in error_nets:
-							mismatch.append((None, p)) 
-				
-		return list(set(mismatch))
-		
 # -------------------------------------------------
 # Compare two subcircuits for device mismatch
 # -------------------------------------------------
 
-def device_check_fun(sub1, sub2):
-	sig1 = canonicalize_devices(sub1["ports"], sub1["devices"])
-	sig2 = canonicalize_devices(sub2["ports"], sub2["devices"])
-
-	if [s1[:2] for s1 in sig1] == [s2[:2] for s2 in sig2]:
+def device_check_fun(sub1, sub2, context = None):
+	"""
+	Multiset difference of the devices by kind (type, model, terminals):
+	the number of devices of each model missing from or extra in the 
+	layout, and the instances left without a device of their kind.
+	"""
+	if context is None:
+		context = CellContext(sub1, sub2)
+	count1 = Counter(context.kinds1)
+	count2 = Counter(context.kinds2)
+	if count1 == count2:
 		return {}
-	else:
-		diff = {
-			"Schematic": [(s[0],s[2]) for s in sig1 if s[:2] not in sig2],
-			"Layout":   [(s[0], s[2]) for s in sig2 if s[:2] not in sig1]
-		}
-		diff["Schematic"].sort()
-		diff["Layout"].sort()
-		
-		if [d1[0] for d1 in diff["Schematic"]] == [d2[0] for d2 in diff["Layout"]]:
-			return {}
-		else:
-			return diff
+	
+	missing = Counter()
+	extra = Counter()
+	for kind, n in (count1 - count2).items():
+		missing[kind[1]] += n
+	for kind, n in (count2 - count1).items():
+		extra[kind[1]] += n
+	
+	only1, only2 = context.unmatched
+	diff = {
+		"Schematic": [(normalize_model(sub1["devices"][i]["model"]), sub1["devices"][i]["inst"]) for i in only1],
+		"Layout":   [(normalize_model(sub2["devices"][j]["model"]), sub2["devices"][j]["inst"]) for j in only2],
+		"Missing":  dict(sorted(missing.items())),
+		"Extra":    dict(sorted(extra.items()))
+	}
+	diff["Schematic"].sort()
+	diff["Layout"].sort()
+	return diff
 
 # -------------------------------------------------
 # Main compare function
 # -------------------------------------------------
-def dev_nets_checker(cellname, source_netlist, layout_netlist, skip_cell=[], lvs_check=None):
+def dev_nets_checker(cellname, source_netlist, layout_netlist, skip_cell=[], lvs_check=None, context=None):
 	final = {}
 	
 	if cellname not in skip_cell and cellname in source_netlist and cellname in layout_netlist:
 		if lvs_check == "nets":
-			final[cellname] = nets_check_fun(source_netlist[cellname], layout_netlist[cellname])
+			final[cellname] = nets_check_fun(source_netlist[cellname], layout_netlist[cellname], context)
 		elif lvs_check == "devices":
-			final[cellname] = device_check_fun(source_netlist[cellname], layout_netlist[cellname])
+			final[cellname] = device_check_fun(source_netlist[cellname], layout_netlist[cellname], context)
 
 	return final
 
@@ -0,0 +1,46 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# Listener of the current thread: listener(event, data)
+local = threading.local()
+
+#==========================================================================
+
+def set_listener(listener):
+	"""Sets the listener receiving the progress events of this thread (None to stop)"""
+	local.listener = listener
+
+#==========================================================================
+
+def emit(event, **data):
+	listener = getattr(local, "listener", None)
+	if listener is not None:
+		data.setdefault("cell", getattr(local, "cell", None))
+		listener(event, data)
+
+#==========================================================================
+
+@contextmanager
+def stage(name):
+	"""Emits stage_start and stage_end (with the elapsed seconds) around a stage"""
+	start = time.time()
+	emit("stage_start", stage = name)
+	try:
+		yield
+	finally:
+		emit("stage_end", stage = name, elapsed = round(time.time() - start, 3))
+
+#==========================================================================
+
+@contextmanager
+def cell_scope(cell):
+	"""Tags the events emitted inside with the cell"""
+	start = time.time()
+	local.cell = cell
+	emit("cell_start")
+	try:
+		yield
+	finally:
+		emit("cell_end", elapsed = round(time.time() - start, 3))
+		local.cell = None
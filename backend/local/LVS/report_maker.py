@@ -1,5 +1,7 @@
 from datetime import datetime
 
+from .lvs_checks.size_check import SIZE_TOLERANCE
+
 def ports_check_report(port_var, cell):
 	if port_var[cell] == {}:
 		flag = 0
@@ -20,13 +22,20 @@ def ports_check_report(port_var, cell):
 	
 
 
+#==========================================================================
+
+def device_count_line(counts):
+	if not counts:
+		return "NONE"
+	return ", ".join(f"{model} x {n}" for model, n in counts.items())
+
 #==========================================================================
 
 def device_check_report(dev_var, cell):
 	line = ""
 	count = 0
-	for key, val in dev_var[cell].items():
-		for dev in val:
+	for key in ("Schematic", "Layout"):
+		for dev in dev_var[cell].get(key, []):
 			count+=1
 			line = line + f'''
 	------------------------------------------------------------
@@ -35,12 +44,17 @@ def device_check_report(dev_var, cell):
 	{key}
 	Device Type          : {dev[0]}
 	Instance Name        : {dev[1]}\n'''
+	
+	summary = ""
+	if dev_var[cell]:
+		summary = f'''	Missing in Layout   : {device_count_line(dev_var[cell].get("Missing"))}
+	Extra in Layout     : {device_count_line(dev_var[cell].get("Extra"))}\n'''
 		
 	return f'''
 	========================
 	DEVICE MISMATCHES
 	========================
-	Total Device Errors : {count}\n'''+line, count
+	Total Device Errors : {count}\n'''+summary+line, count
 
 	
 
@@ -139,7 +153,7 @@ def shorts_check_report(shorts_var, cell):
 	
 #==========================================================================
 
-def make_report(user, cell, source, layout, supply, dev_cnt, port_cnt, net_cnt, checks, var):
+def make_report(user, cell, source, layout, supply, dev_cnt, port_cnt, net_cnt, checks, var, hierarchy = "Flattened", tol = SIZE_TOLERANCE):
 	run_date = datetime.now()
 	run_date = run_date.strftime("%d-%m-%Y %H:%M:%S")
 		
@@ -207,10 +221,10 @@ def make_report(user, cell, source, layout, supply, dev_cnt, port_cnt, net_cnt,
 	------------------------------------------------------------
 	RUN OPTIONS
 	------------------------------------------------------------
-	Hierarchy Mode    : Flattened
+	Hierarchy Mode    : {hierarchy}
 	Pin Matching      : By Name
 	Net Matching      : By Connectivity
-	Tolerance (W/L)   : 2%
+	Tolerance (W/L)   : {tol * 100:g}%
 
 	------------------------------------------------------------
 	LVS SUMMARY
@@ -10,11 +10,8 @@ cell_list_bp = Blueprint('cell_list', __name__)
 
 def lvs_celllist(cir, gds):
 	cir_cells = cirScan.extract_cells(cir)
-	hier_cells = gdsScan.scanGds(gds)
-	
-	gds_cells = []
-	for arr in hier_cells:
-		gds_cells.append(arr["cellname"])
+	# Top cells from the record stream (or the sidecar index), no geometry is built
+	gds_cells = gdsScan.topCells(gdsScan.readGdsStream(gds)["cells"])
 		
 	lvs_cells = list(set(cir_cells) & set(gds_cells))
 	print("LVS Cells:", lvs_cells)
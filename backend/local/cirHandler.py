@@ -1,10 +1,10 @@
 # cirHandler.py
 from flask import Blueprint, request, jsonify
 import os
-from io import BytesIO
 
 from flask_jwt_extended import get_jwt_identity, jwt_required
 import cirScan
+from uploads import store_upload
 
 cir_bp = Blueprint("cir", __name__)
 
@@ -46,7 +46,7 @@ def get_circells():
     os.makedirs(user_dir, exist_ok=True)
 
     save_path = os.path.join(user_dir, filename)
-    file.save(save_path)
+    sha256 = store_upload(file, save_path)
 
     try:
         # ====== Extract Metadata ======
@@ -66,7 +66,8 @@ def get_circells():
             "instances": instances,
             "cellList": list(set(cell_names)),
             "hierarchyTree": tree,
-            "savedPath": f"users/{username}/{filename}"
+            "savedPath": f"users/{username}/{filename}",
+            "sha256": sha256
         })
 
     except Exception as e:
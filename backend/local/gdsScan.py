@@ -1,6 +1,72 @@
 import gdspy
 import os
 import re
+import json
+import math
+import mmap
+import struct
+import hashlib
+import threading
+from collections import OrderedDict
+
+#===========================================================================
+# Parsed library cache
+#===========================================================================
+
+# Libraries of this process: {(device, inode): (mtime, size, nbytes, gdspy.GdsLibrary)}, least recently used first.
+# Keyed by file identity, so the hard links of a stored upload share one entry
+library_cache = OrderedDict()
+library_lock = threading.Lock()
+
+# Memory budget of the cache (estimated from the polygon arrays)
+LIBRARY_CACHE_BYTES = 1024 * 1024 * 1024
+
+
+def library_size(gds):
+	"""Estimated memory of a library: polygon arrays plus a fixed cost per element"""
+	size = 0
+	for cell in gds.cells.values():
+		for element in cell.polygons:
+			size += 200 + sum(p.nbytes for p in element.polygons)
+		size += 200 * (len(cell.paths) + len(cell.labels) + len(cell.references))
+	return size
+
+
+def load_library(inpGds, precision=1e-09, unit=1e-06):
+	"""
+	Returns the parsed gdspy.GdsLibrary of a GDS file, shared by every caller 
+	while the file is unchanged (same mtime and size). The library must not be modified.
+	
+	The geometry is read in the user units of the file (units='skip'), so
+	precision and unit do not change what is read and are not part of the key.
+	Streams are parsed without caching.
+	"""
+	if not isinstance(inpGds, (str, os.PathLike)):
+		return gdspy.GdsLibrary(infile=inpGds, precision=precision, unit=unit)
+		
+	path = os.path.abspath(inpGds)
+	stat = os.stat(path)
+	key = (stat.st_dev, stat.st_ino)
+	with library_lock:
+		cached = library_cache.get(key)
+		if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+			library_cache.move_to_end(key)
+			return cached[3]
+	
+	gds = gdspy.GdsLibrary(infile=path, precision=precision, unit=unit)
+	nbytes = library_size(gds)
+	
+	with library_lock:
+		library_cache[key] = (stat.st_mtime_ns, stat.st_size, nbytes, gds)
+		library_cache.move_to_end(key)
+		total = sum(entry[2] for entry in library_cache.values())
+		while total > LIBRARY_CACHE_BYTES and len(library_cache) > 1:
+			_, evicted = library_cache.popitem(last=False)
+			total -= evicted[2]
+			
+	return gds
+
+#===========================================================================
 
 def iterateOverCell(cellId):
 	dependence_tree = []
@@ -15,7 +81,7 @@ def iterateOverCell(cellId):
 
 		
 def scanGds(inGds,cellName=None,precision=1e-09,unit=1e-06):
-	gdsii = gdspy.GdsLibrary(infile=inGds,precision=precision,unit=unit)
+	gdsii = load_library(inGds,precision,unit)
 	if cellName==None:
 		topcell=gdsii.top_level()
 	else:
@@ -41,7 +107,7 @@ def scanGds(inGds,cellName=None,precision=1e-09,unit=1e-06):
 
 def getLayer_fromGds(inpGds,selectCells,precision=1e-09,unit=1e-06):
 	layerList = set()
-	gds=gdspy.GdsLibrary(infile=inpGds,precision=precision,unit=unit)
+	gds=load_library(inpGds,precision,unit)
 	
 	if len(selectCells)!=0:
 		for cell in selectCells:
@@ -62,7 +128,7 @@ def getLayer_fromGds(inpGds,selectCells,precision=1e-09,unit=1e-06):
 
 def getTextLayer_fromGds(inpGds,selectCells,precision=1e-09,unit=1e-06):
 	textLayer = set()
-	gds=gdspy.GdsLibrary(infile=inpGds,precision=precision,unit=unit)
+	gds=load_library(inpGds,precision,unit)
 	
 	if len(selectCells)!=0:
 		for cell in selectCells:
@@ -83,7 +149,7 @@ def getTextLayer_fromGds(inpGds,selectCells,precision=1e-09,unit=1e-06):
 
 def getLabels_fromGds(inpGds,selectCells,precision=1e-09,unit=1e-06):
 	labels={}
-	gds=gdspy.GdsLibrary(infile=inpGds,precision=precision,unit=unit)
+	gds=load_library(inpGds,precision,unit)
 	
 	if len(selectCells)!=0:
 		for cell in selectCells:
@@ -104,8 +170,65 @@ def getLabels_fromGds(inpGds,selectCells,precision=1e-09,unit=1e-06):
 
 #===========================================================================
 
+def scanLibrary(inpGds,selectCells,precision=1e-09,unit=1e-06):
+	"""
+	Collects in a single pass over the cells what getLayer_fromGds, 
+	getTextLayer_fromGds and getLabels_fromGds return.
+	
+	Returns:
+		layers, text layers, labels
+	"""
+	gds=load_library(inpGds,precision,unit)
+	layerList = set()
+	textLayer = set()
+	labels = {}
+	
+	# Label texts of a cell and of its references (as cell.get_labels())
+	texts = {}
+	def cellTexts(cell):
+		if cell.name not in texts:
+			found = [lbl.text for lbl in cell.labels]
+			for ref in cell.references:
+				if isinstance(ref.ref_cell, gdspy.Cell):
+					count = ref.columns * ref.rows if isinstance(ref, gdspy.CellArray) else 1
+					found.extend(cellTexts(ref.ref_cell) * count)
+			texts[cell.name] = found
+		return texts[cell.name]
+	
+	if len(selectCells)!=0:
+		names = [cell for cell in selectCells if cell in gds.cells.keys()]
+	else:
+		names = list(gds.cells)
+	
+	for cell in names:
+		topcell=gds.cells[cell]
+		for element in topcell.polygons + topcell.paths:
+			layerList.add((int(element.layers[0]), int(element.datatypes[0])))
+		for lbl in topcell.labels:
+			textLayer.add((int(lbl.layer), int(lbl.texttype)))
+		
+		if len(selectCells)!=0:
+			labels[cell] = list(cellTexts(topcell))
+		else:
+			labels[cell] = [text for text in cellTexts(topcell) if re.search("^[0-9a-z_]+$",text,re.I)]
+	
+	# Text layers of the referenced cells (cell.get_labels() is recursive)
+	seen = set(names)
+	stack = [gds.cells[cell] for cell in names]
+	while stack:
+		for ref in stack.pop().references:
+			if isinstance(ref.ref_cell, gdspy.Cell) and ref.ref_cell.name not in seen:
+				seen.add(ref.ref_cell.name)
+				stack.append(ref.ref_cell)
+				for lbl in ref.ref_cell.labels:
+					textLayer.add((int(lbl.layer), int(lbl.texttype)))
+	
+	return sorted(layerList), sorted(textLayer), labels
+
+#===========================================================================
+
 def getInstance_fromGds(inpGds,precision=1e-09,unit=1e-06):
-	gds=gdspy.GdsLibrary(infile=inpGds,precision=precision,unit=unit)
+	gds=load_library(inpGds,precision,unit)
 	
 	instList=[]
 	for cell in gds.cells:
@@ -124,3 +247,421 @@ def getGdsUnits(inpGds):
 	return [unit,precision]
 
 	
+#===========================================================================
+# Streaming record reader (hierarchy and inventories without geometry)
+#===========================================================================
+
+# GDSII record types
+UNITS = 0x03
+BGNSTR = 0x05
+STRNAME = 0x06
+ENDSTR = 0x07
+BOUNDARY = 0x08
+PATH = 0x09
+SREF = 0x0A
+AREF = 0x0B
+TEXT = 0x0C
+LAYER = 0x0D
+DATATYPE = 0x0E
+ENDEL = 0x11
+SNAME = 0x12
+COLROW = 0x13
+TEXTTYPE = 0x16
+STRING = 0x19
+BOX = 0x2D
+BOXTYPE = 0x2E
+WIDTH = 0x0F
+XY = 0x10
+STRANS = 0x1A
+MAG = 0x1B
+ANGLE = 0x1C
+
+# Parsed structures of this process: {(device, inode): (mtime, size, structure)}
+stream_cache = OrderedDict()
+STREAM_CACHE_SIZE = 32
+
+
+def gdsReal(data):
+	"""Decodes an 8 byte GDSII real (excess-64, base 16)"""
+	sign = -1 if data[0] & 0x80 else 1
+	exponent = (data[0] & 0x7F) - 64
+	mantissa = int.from_bytes(data[1:8], "big")
+	return sign * mantissa * 16.0 ** (exponent - 14)
+
+
+def gdsString(data):
+	return bytes(data).rstrip(b"\0").decode("ascii", "replace")
+
+
+def readRecords(buf):
+	"""Yields (record type, payload start, payload end) of every record, without reading the payloads"""
+	pos = 0
+	end = len(buf)
+	while pos + 4 <= end:
+		size, rtype = struct.unpack_from(">HB", buf, pos)
+		if size < 4:
+			break
+		yield rtype, pos + 4, pos + size
+		pos += size
+
+
+def readStructure(buf):
+	"""
+	Walks the records once. XY payloads (and every record not needed 
+	for the hierarchy, layers and labels) are skipped by their length.
+	
+	Returns:
+		dict: {unit, precision, cells: {name: {refs: [(child, placements)], layers, text_layers, labels}}}
+	"""
+	unit, precision = None, None
+	cells = OrderedDict()
+	cell = None
+	element = None
+	
+	for rtype, start, end in readRecords(buf):
+		if rtype == UNITS:
+			user, meters = gdsReal(buf[start:start + 8]), gdsReal(buf[start + 8:start + 16])
+			unit, precision = meters / user, meters
+		elif rtype == STRNAME:
+			cell = {"refs": [], "layers": set(), "text_layers": set(), "labels": []}
+			cells[gdsString(buf[start:end])] = cell
+		elif rtype == ENDSTR:
+			cell = None
+		elif cell is None:
+			continue
+		elif rtype in (BOUNDARY, PATH, BOX, TEXT, SREF, AREF):
+			element = {"type": rtype, "layer": 0, "datatype": 0, "count": 1}
+		elif element is None:
+			continue
+		elif rtype == LAYER:
+			element["layer"] = struct.unpack_from(">h", buf, start)[0]
+		elif rtype in (DATATYPE, BOXTYPE, TEXTTYPE):
+			element["datatype"] = struct.unpack_from(">h", buf, start)[0]
+		elif rtype == STRING:
+			element["text"] = gdsString(buf[start:end])
+		elif rtype == SNAME:
+			element["sname"] = gdsString(buf[start:end])
+		elif rtype == COLROW:
+			columns, rows = struct.unpack_from(">hh", buf, start)
+			element["count"] = columns * rows
+		elif rtype == ENDEL:
+			if element["type"] in (BOUNDARY, PATH, BOX):
+				cell["layers"].add((element["layer"], element["datatype"]))
+			elif element["type"] == TEXT:
+				cell["text_layers"].add((element["layer"], element["datatype"]))
+				cell["labels"].append(element.get("text", ""))
+			elif "sname" in element:
+				cell["refs"].append((element["sname"], element["count"]))
+			element = None
+			
+	return {"unit": unit, "precision": precision, "cells": cells}
+
+
+def readGdsStream(inpGds):
+	"""
+	Returns readStructure of a GDS file (from its sidecar index if there 
+	is one, else read through a memory map), reusing the last result 
+	while the file is unchanged (same mtime and size)
+	"""
+	path = os.path.abspath(inpGds)
+	stat = os.stat(path)
+	key = (stat.st_dev, stat.st_ino)
+	with library_lock:
+		cached = stream_cache.get(key)
+		if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+			stream_cache.move_to_end(key)
+			return cached[2]
+	
+	index = loadIndex(path)
+	if index is not None:
+		structure = structureFromIndex(index)
+	elif stat.st_size == 0:
+		structure = {"unit": None, "precision": None, "cells": OrderedDict()}
+	else:
+		with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+			structure = readStructure(buf)
+	
+	with library_lock:
+		stream_cache[key] = (stat.st_mtime_ns, stat.st_size, structure)
+		stream_cache.move_to_end(key)
+		while len(stream_cache) > STREAM_CACHE_SIZE:
+			stream_cache.popitem(last=False)
+	return structure
+
+#===========================================================================
+# Sidecar index (written in the background after an upload)
+#===========================================================================
+
+INDEX_SUFFIX = ".index.json"
+INDEX_VERSION = 1
+
+
+def transformPoints(points, strans, mag, angle, origin):
+	"""Places points of a referenced cell: reflection about x, magnification, rotation, translation"""
+	cos, sin = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+	placed = []
+	for x, y in points:
+		if strans & 0x8000:
+			y = -y
+		x, y = x * mag, y * mag
+		placed.append((origin[0] + x * cos - y * sin, origin[1] + x * sin + y * cos))
+	return placed
+
+
+def refOrigins(ref):
+	"""Origins of the corner placements of a reference (every placement of an SREF, the 4 corners of an AREF)"""
+	xy = ref["xy"]
+	if ref["type"] == SREF:
+		return [xy[:2]]
+	columns, rows = max(ref["columns"], 1), max(ref["rows"], 1)
+	column = ((xy[2] - xy[0]) / columns, (xy[3] - xy[1]) / columns)
+	row = ((xy[4] - xy[0]) / rows, (xy[5] - xy[1]) / rows)
+	return [(xy[0] + i * column[0] + j * row[0], xy[1] + i * column[1] + j * row[1])
+			for i in {0, columns - 1} for j in {0, rows - 1}]
+
+
+def indexStructure(buf):
+	"""
+	Walks the records once, reading the coordinates too.
+	
+	Returns:
+		dict: {units (UNITS payload), cells: {name: {refs, shapes: {"layer/datatype": count}, 
+		labels: [(layer, texttype, text)], digest, box}}}, box being the bounding box of 
+		the cell's own shapes in database units (None if it has none)
+	"""
+	units = b""
+	cells = OrderedDict()
+	cell = None
+	element = None
+	
+	for rtype, start, end in readRecords(buf):
+		if rtype == UNITS:
+			units = bytes(buf[start:end])
+		elif rtype == BGNSTR:
+			# Same hash as the LVS extraction cache: every record but BGNSTR and ENDSTR
+			digest = hashlib.sha256()
+		elif rtype == STRNAME:
+			cell = {"refs": [], "shapes": {}, "labels": [], "box": None}
+			cells[gdsString(buf[start:end])] = cell
+			digest.update(buf[start - 4:end])
+		elif rtype == ENDSTR:
+			if cell is not None:
+				cell["digest"] = digest.hexdigest()
+			cell = None
+		elif cell is None:
+			continue
+		else:
+			digest.update(buf[start - 4:end])
+			if rtype in (BOUNDARY, PATH, BOX, TEXT, SREF, AREF):
+				element = {"type": rtype, "layer": 0, "datatype": 0, "width": 0, "xy": (),
+						   "strans": 0, "mag": 1.0, "angle": 0.0, "columns": 1, "rows": 1}
+			elif element is None:
+				continue
+			elif rtype == LAYER:
+				element["layer"] = struct.unpack_from(">h", buf, start)[0]
+			elif rtype in (DATATYPE, BOXTYPE, TEXTTYPE):
+				element["datatype"] = struct.unpack_from(">h", buf, start)[0]
+			elif rtype == WIDTH:
+				element["width"] = abs(struct.unpack_from(">i", buf, start)[0])
+			elif rtype == XY:
+				element["xy"] = struct.unpack_from(f">{(end - start) // 4}i", buf, start)
+			elif rtype == STRANS:
+				element["strans"] = struct.unpack_from(">H", buf, start)[0]
+			elif rtype == MAG:
+				element["mag"] = gdsReal(buf[start:start + 8])
+			elif rtype == ANGLE:
+				element["angle"] = gdsReal(buf[start:start + 8])
+			elif rtype == STRING:
+				element["text"] = gdsString(buf[start:end])
+			elif rtype == SNAME:
+				element["sname"] = gdsString(buf[start:end])
+			elif rtype == COLROW:
+				element["columns"], element["rows"] = struct.unpack_from(">hh", buf, start)
+			elif rtype == ENDEL:
+				if element["type"] in (BOUNDARY, PATH, BOX):
+					key = f'{element["layer"]}/{element["datatype"]}'
+					cell["shapes"][key] = cell["shapes"].get(key, 0) + 1
+					xs, ys = element["xy"][0::2], element["xy"][1::2]
+					if xs:
+						pad = element["width"] / 2 if element["type"] == PATH else 0
+						cell["box"] = mergeBox(cell["box"], (min(xs) - pad, min(ys) - pad, max(xs) + pad, max(ys) + pad))
+				elif element["type"] == TEXT:
+					cell["labels"].append((element["layer"], element["datatype"], element.get("text", "")))
+				elif "sname" in element and len(element["xy"]) >= (2 if element["type"] == SREF else 6):
+					cell["refs"].append(element)
+				element = None
+	
+	return {"units": units, "cells": cells}
+
+
+def mergeBox(box, other):
+	if box is None:
+		return other
+	if other is None:
+		return box
+	return (min(box[0], other[0]), min(box[1], other[1]), max(box[2], other[2]), max(box[3], other[3]))
+
+
+def hierarchyBoxes(cells):
+	"""Bounding boxes of the cells with their references placed (database units)"""
+	boxes = {}
+	
+	def cellBox(name):
+		if name not in boxes:
+			boxes[name] = None			# guards against reference cycles
+			box = cells[name]["box"]
+			for ref in cells[name]["refs"]:
+				child = ref["sname"]
+				childBox = cellBox(child) if child in cells else None
+				if childBox is None:
+					continue
+				corners = [(childBox[0], childBox[1]), (childBox[0], childBox[3]), (childBox[2], childBox[1]), (childBox[2], childBox[3])]
+				for origin in refOrigins(ref):
+					points = transformPoints(corners, ref["strans"], ref["mag"], ref["angle"], origin)
+					box = mergeBox(box, (min(x for x, _ in points), min(y for _, y in points),
+										 max(x for x, _ in points), max(y for _, y in points)))
+			boxes[name] = box
+		return boxes[name]
+	
+	for name in cells:
+		cellBox(name)
+	return boxes
+
+
+def writeIndex(inpGds, indexPath):
+	"""
+	Writes the sidecar index of a GDS file: units, and per cell the references, 
+	shape counts by layer/datatype, labels by text layer, bounding box (user units) 
+	and record hash. Tied to the file by its size and mtime.
+	"""
+	stat = os.stat(inpGds)
+	if stat.st_size == 0:
+		structure = {"units": b"", "cells": OrderedDict()}
+	else:
+		with open(inpGds, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+			structure = indexStructure(buf)
+	
+	units = structure["units"]
+	unit, precision, scale = None, None, 1.0
+	if len(units) >= 16:
+		user, meters = gdsReal(units[:8]), gdsReal(units[8:16])
+		unit, precision, scale = meters / user, meters, user
+	
+	cells = structure["cells"]
+	boxes = hierarchyBoxes(cells)
+	index = {
+		"version": INDEX_VERSION,
+		"size": stat.st_size,
+		"mtime_ns": stat.st_mtime_ns,
+		"unit": unit,
+		"precision": precision,
+		"units": units.hex(),
+		"cells": {name: {
+			"refs": [[ref["sname"], ref["columns"] * ref["rows"] if ref["type"] == AREF else 1] for ref in cell["refs"]],
+			"shapes": cell["shapes"],
+			"labels": cell["labels"],
+			"bbox": [round(v * scale, 9) for v in boxes[name]] if boxes[name] is not None else None,
+			"digest": cell["digest"]
+		} for name, cell in cells.items() if "digest" in cell}
+	}
+	
+	tmp_path = f"{indexPath}.{os.getpid()}.{threading.get_ident()}.tmp"
+	with open(tmp_path, "w") as f:
+		json.dump(index, f, separators=(",", ":"))
+	os.replace(tmp_path, indexPath)
+
+
+def loadIndex(inpGds):
+	"""The sidecar index of a GDS file, or None if there is none or it is out of date"""
+	try:
+		stat = os.stat(inpGds)
+		with open(inpGds + INDEX_SUFFIX, "r") as f:
+			index = json.load(f)
+	except (OSError, ValueError):
+		return None
+	if index.get("version") != INDEX_VERSION or (index.get("size"), index.get("mtime_ns")) != (stat.st_size, stat.st_mtime_ns):
+		return None
+	return index
+
+
+def structureFromIndex(index):
+	"""readStructure's result from a sidecar index"""
+	cells = OrderedDict()
+	for name, cell in index["cells"].items():
+		cells[name] = {
+			"refs": [(child, count) for child, count in cell["refs"]],
+			"layers": {tuple(int(v) for v in key.split("/")) for key in cell["shapes"]},
+			"text_layers": {(layer, texttype) for layer, texttype, _ in cell["labels"]},
+			"labels": [text for _, _, text in cell["labels"]]
+		}
+	return {"unit": index["unit"], "precision": index["precision"], "cells": cells}
+
+#===========================================================================
+
+def topCells(cells):
+	"""Cells not referenced by another cell"""
+	referenced = {child for cell in cells.values() for child, _ in cell["refs"]}
+	return [name for name in cells if name not in referenced]
+
+
+def scanGdsStream(inGds,cellName=None):
+	"""scanGds from the record stream"""
+	cells = readGdsStream(inGds)["cells"]
+	
+	# Each subtree is built once and shared by every parent
+	memo = {}
+	def iterateOverName(name):
+		if name not in memo:
+			dependence_tree = []
+			for child in dict.fromkeys(child for child, _ in cells[name]["refs"]):
+				if child in cells:
+					dependence_tree.append({"cellname": child, "dependencies": iterateOverName(child)})
+			memo[name] = dependence_tree
+		return memo[name]
+	
+	names = topCells(cells) if cellName==None else [cellName]
+	return [{"cellname": name, "dependencies": iterateOverName(name)} for name in names]
+
+#===========================================================================
+
+def scanInventory(inpGds,selectCells):
+	"""scanLibrary (layers, text layers, labels) from the record stream"""
+	cells = readGdsStream(inpGds)["cells"]
+	layerList = set()
+	textLayer = set()
+	labels = {}
+	
+	texts = {}
+	def cellTexts(name):
+		if name not in texts:
+			found = list(cells[name]["labels"])
+			for child, count in cells[name]["refs"]:
+				if child in cells:
+					found.extend(cellTexts(child) * count)
+			texts[name] = found
+		return texts[name]
+	
+	if len(selectCells)!=0:
+		names = [cell for cell in selectCells if cell in cells]
+	else:
+		names = list(cells)
+	
+	for cell in names:
+		layerList.update(cells[cell]["layers"])
+		if len(selectCells)!=0:
+			labels[cell] = list(cellTexts(cell))
+		else:
+			labels[cell] = [text for text in cellTexts(cell) if re.search("^[0-9a-z_]+$",text,re.I)]
+	
+	# Text layers of the cells and of the cells they reference
+	seen = set(names)
+	stack = list(names)
+	while stack:
+		name = stack.pop()
+		textLayer.update(cells[name]["text_layers"])
+		for child, _ in cells[name]["refs"]:
+			if child in cells and child not in seen:
+				seen.add(child)
+				stack.append(child)
+	
+	return sorted(layerList), sorted(textLayer), labels
@@ -1,6 +1,14 @@
-from flask import Blueprint, request, jsonify ,send_file
+from flask import Blueprint, request, jsonify ,send_file, Response, stream_with_context, current_app
 import os
+import json
+import uuid
+import queue
+import shutil
+import threading
 from LVS.lvs_runner import lvs_runner
+from LVS.lvs_checks.size_check import SIZE_TOLERANCE
+from LVS.progress import set_listener
+from lvs_jobs import submit_job, get_job, get_pool, init_db, MAX_JOBS
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 lvs_bp = Blueprint('lvs', __name__)
@@ -11,6 +19,31 @@ from LVS.lvs_runner import lvs_runner
 
 lvs_bp = Blueprint('lvs', __name__)
 
+def lvs_inputs(username, data):
+    user_dir = os.path.join("users", username)
+
+    netlist_path = os.path.join(user_dir, data.get("netlist"))
+    layout_path  = os.path.join(user_dir, data.get("layout"))
+
+    print("Netlist path:", netlist_path)
+    print("Layout path:", layout_path)  
+
+    selected_cells = data.get("selected_cells", [])
+    checks = data.get("checks", [])
+
+    return {
+        "username": username,
+        "netlist": netlist_path,
+        "layout": layout_path,
+        "selected_cells": selected_cells,
+        "checks": checks,
+        "hierarchical": data.get("hierarchical", False),
+        "workers": data.get("workers", 1),
+        "size_tolerance": float(data.get("size_tolerance", SIZE_TOLERANCE)),
+        "config_path": "LVS/config.json",
+        "layermap": "LVS/layermap_SCL.json"
+    }
+
 @lvs_bp.route('/lvs_runner', methods=['POST'])
 # @jwt_required()
 def lvs_runner_api():
@@ -24,25 +57,7 @@ def lvs_runner_api():
         username = "sahil"
         # username = get_jwt_identity()
         user_dir = os.path.join("users", username)
-
-        netlist_path = os.path.join(user_dir, data.get("netlist"))
-        layout_path  = os.path.join(user_dir, data.get("layout"))
-
-        print("Netlist path:", netlist_path)
-        print("Layout path:", layout_path)  
-
-        selected_cells = data.get("selected_cells", [])
-        checks = data.get("checks", [])
-
-        inputs = {
-            "username": username,
-            "netlist": netlist_path,
-            "layout": layout_path,
-            "selected_cells": selected_cells,
-            "checks": checks,
-            "config_path": "LVS/config.json",
-            "layermap": "LVS/layermap_SCL.json"
-        }
+        inputs = lvs_inputs(username, data)
 
         # Run LVS
         lvs_runner(inputs)
@@ -64,3 +79,126 @@ def lvs_runner_api():
     # except Exception as e:
     #     print("Error in LVS API:", str(e))
     #     return jsonify({"status": "error", "message": str(e)}), 500
+
+# ==========================================================================
+# Progress streaming (Server-Sent Events)
+# ==========================================================================
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@lvs_bp.route('/lvs_runner/stream', methods=['POST'])
+# @jwt_required()
+def lvs_runner_stream_api():
+    """
+    Runs LVS like /lvs_runner and streams its progress as Server-Sent Events:
+    cell_start, stage_start, stage_end (with elapsed seconds), cell_end, ...
+    and finally done (with the report) or error.
+    """
+    data = request.get_json()
+    username = "sahil"
+    # username = get_jwt_identity()
+
+    inputs = lvs_inputs(username, data)
+    # Stage events are emitted by the process running the cells
+    inputs["workers"] = 1
+    run_dir = os.path.join("users", username, "streams", uuid.uuid4().hex)
+    inputs["report_path"] = os.path.join(run_dir, "lvs_report.txt")
+
+    events = queue.Queue()
+
+    def run():
+        set_listener(lambda event, payload: events.put((event, payload)))
+        try:
+            lvs_runner(inputs, lambda cell, done, total: events.put(("progress", {"cell": cell, "done": done, "total": total})))
+            if os.path.exists(inputs["report_path"]):
+                with open(inputs["report_path"]) as f:
+                    events.put(("done", {"report": f.read()}))
+            else:
+                events.put(("error", {"message": "Report not generated."}))
+        except Exception as e:
+            events.put(("error", {"message": str(e)}))
+        finally:
+            set_listener(None)
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    threading.Thread(target=run, daemon=True).start()
+
+    def stream():
+        while True:
+            event, payload = events.get()
+            yield sse_event(event, payload)
+            if event in ("done", "error"):
+                break
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# ==========================================================================
+# Asynchronous jobs
+# ==========================================================================
+
+@lvs_bp.record_once
+def create_jobs_table(state):
+    """The jobs table exists before the first status request"""
+    init_db()
+
+
+@lvs_bp.before_app_request
+def resume_jobs():
+    """
+    Starts the worker pool on the first request this server process handles,
+    which resumes the queued or running jobs whose server is gone (expired
+    lease, see lvs_jobs). (Not at registration: the debug reloader also 
+    registers the blueprints in its watcher process.)
+    """
+    get_pool(current_app.config.get("LVS_MAX_JOBS", MAX_JOBS))
+
+
+@lvs_bp.route('/jobs', methods=['POST'])
+# @jwt_required()
+def lvs_submit_api():
+    """Queues an LVS run and returns its job id at once"""
+    data = request.get_json()
+    username = "sahil"
+    # username = get_jwt_identity()
+
+    job_id = submit_job(username, lvs_inputs(username, data))
+    return jsonify({"status": "success", "job_id": job_id}), 202
+
+
+@lvs_bp.route('/jobs/<job_id>', methods=['GET'])
+# @jwt_required()
+def lvs_job_status_api(job_id):
+    username = "sahil"
+    # username = get_jwt_identity()
+
+    job = get_job(job_id)
+    if job is None or job["username"] != username:
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+
+    return jsonify({
+        "status": "success",
+        "job_id": job_id,
+        "state": job["status"],
+        "progress": job["progress"],
+        "total": job["total"],
+        "error": job["error"]
+    })
+
+
+@lvs_bp.route('/jobs/<job_id>/report', methods=['GET'])
+# @jwt_required()
+def lvs_job_report_api(job_id):
+    username = "sahil"
+    # username = get_jwt_identity()
+
+    job = get_job(job_id)
+    if job is None or job["username"] != username:
+        return jsonify({"status": "error", "message": "Job not found."}), 404
+
+    if job["status"] != "done":
+        return jsonify({"status": "error", "message": f"Job is {job['status']}.", "state": job["status"]}), 409
+
+    return send_file(os.path.abspath(job["report_path"]), as_attachment=True, download_name="lvs_report.txt")
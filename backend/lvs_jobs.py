@@ -0,0 +1,169 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from LVS.lvs_runner import lvs_runner
+
+# Jobs are kept in SQLite, so they survive a server restart
+JOBS_DB = os.path.join("users", "lvs_jobs.db")
+
+# Number of LVS jobs running at the same time, unless the app sets LVS_MAX_JOBS
+MAX_JOBS = 2
+
+# The jobs of a server process are leased to it and renewed while it runs.
+# Another server process (or the next server) resumes them once the lease expires
+LEASE_SECONDS = 60
+HEARTBEAT_SECONDS = 15
+
+pool = None
+pool_lock = threading.Lock()
+server_id = None
+
+#==========================================================================
+
+def connect():
+	os.makedirs(os.path.dirname(JOBS_DB), exist_ok=True)
+	db = sqlite3.connect(JOBS_DB, timeout=30)
+	db.row_factory = sqlite3.Row
+	return db
+
+#==========================================================================
+
+def init_db():
+	with connect() as db:
+		db.execute("""
+			CREATE TABLE IF NOT EXISTS jobs (
+				id TEXT PRIMARY KEY,
+				username TEXT NOT NULL,
+				status TEXT NOT NULL,
+				progress INTEGER DEFAULT 0,
+				total INTEGER DEFAULT 0,
+				inputs TEXT NOT NULL,
+				report_path TEXT NOT NULL,
+				error TEXT DEFAULT '',
+				created REAL,
+				updated REAL,
+				owner TEXT DEFAULT '',
+				lease REAL DEFAULT 0
+			)""")
+		# Tables created before the leases
+		columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+		if "owner" not in columns:
+			db.execute("ALTER TABLE jobs ADD COLUMN owner TEXT DEFAULT ''")
+		if "lease" not in columns:
+			db.execute("ALTER TABLE jobs ADD COLUMN lease REAL DEFAULT 0")
+
+#==========================================================================
+
+def update_job(job_id, **fields):
+	fields["updated"] = time.time()
+	columns = ", ".join(f"{name} = ?" for name in fields)
+	with connect() as db:
+		db.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+#==========================================================================
+
+def get_job(job_id):
+	"""Returns the job as a dict, or None"""
+	with connect() as db:
+		row = db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+	return dict(row) if row is not None else None
+
+#==========================================================================
+
+def run_job(job_id, inputs):
+	"""Runs a job in a worker process and records its progress and outcome"""
+	update_job(job_id, status="running", progress=0, total=len(inputs["selected_cells"]))
+
+	def progress(cell, done, total):
+		update_job(job_id, progress=done, total=total)
+
+	try:
+		results = lvs_runner(inputs, progress)
+	except Exception as e:
+		update_job(job_id, status="failed", error=f"{type(e).__name__}: {e}")
+		return
+
+	# Cells that could not be extracted, the report holds the others
+	error = "\n".join(f"{cell}: {result[1]}" for cell, result in results.items() if result[0] != True)
+	if os.path.exists(inputs["report_path"]):
+		update_job(job_id, status="done", error=error)
+	else:
+		update_job(job_id, status="failed", error=error or "Report not generated.")
+
+#==========================================================================
+
+def claim_jobs():
+	"""
+	Takes over the queued and running jobs whose lease has expired (their 
+	server process is gone) and queues them again in this server's pool.
+	A job is claimed by a single process: the update only applies while
+	the owner and lease read are unchanged.
+	"""
+	now = time.time()
+	with connect() as db:
+		rows = db.execute(
+			"SELECT id, inputs, owner, lease FROM jobs WHERE status IN ('queued', 'running') AND lease < ? ORDER BY created",
+			(now - LEASE_SECONDS,)
+		).fetchall()
+	for row in rows:
+		with connect() as db:
+			claimed = db.execute(
+				"UPDATE jobs SET status = 'queued', owner = ?, lease = ?, updated = ? WHERE id = ? AND owner = ? AND lease = ?",
+				(server_id, now, now, row["id"], row["owner"], row["lease"])
+			).rowcount
+		if claimed == 1:
+			pool.submit(run_job, row["id"], json.loads(row["inputs"]))
+
+#==========================================================================
+
+def heartbeat():
+	"""Renews the leases of this server's jobs and resumes the jobs of servers that are gone"""
+	while True:
+		time.sleep(HEARTBEAT_SECONDS)
+		try:
+			with connect() as db:
+				db.execute("UPDATE jobs SET lease = ? WHERE owner = ? AND status IN ('queued', 'running')", (time.time(), server_id))
+			claim_jobs()
+		except sqlite3.Error:
+			pass
+
+#==========================================================================
+
+def get_pool(max_jobs=MAX_JOBS):
+	"""Starts the worker pool on first use and resumes the jobs left by servers that are gone"""
+	global pool, server_id
+	with pool_lock:
+		if pool is None:
+			init_db()
+			# Set here, after a pre-forking server has started its processes
+			server_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+			pool = ProcessPoolExecutor(max_workers=max_jobs)
+			claim_jobs()
+			threading.Thread(target=heartbeat, daemon=True).start()
+	return pool
+
+#==========================================================================
+
+def submit_job(username, inputs):
+	"""Queues an LVS run and returns its job id at once"""
+	pool = get_pool()
+
+	job_id = uuid.uuid4().hex
+	inputs = dict(inputs)
+	inputs["report_path"] = os.path.join("users", username, "jobs", job_id, "lvs_report.txt")
+
+	now = time.time()
+	with connect() as db:
+		db.execute(
+			"INSERT INTO jobs (id, username, status, total, inputs, report_path, created, updated, owner, lease) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+			(job_id, username, "queued", len(inputs["selected_cells"]), json.dumps(inputs), inputs["report_path"], now, now, server_id, now)
+		)
+
+	pool.submit(run_job, job_id, inputs)
+	return job_id
@@ -0,0 +1,109 @@
+import os
+import uuid
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Size of the chunks copied from an upload to disk
+CHUNK_SIZE = 1024 * 1024
+
+# Content-addressed store of the uploads, shared by every user
+BLOB_DIR = os.path.join(os.path.dirname(__file__), "users", "blobs")
+
+# Sidecar indexes are built one at a time, in the background
+indexer = ThreadPoolExecutor(max_workers=1)
+
+#==========================================================================
+
+def save_upload(file, save_path):
+	"""
+	Copies an uploaded file to save_path in chunks, hashing it on the way,
+	so that the upload is never held in memory as a whole.
+	The file is written under a temporary name and renamed once complete.
+
+	Returns:
+		str: sha256 of the content
+	"""
+	digest = hashlib.sha256()
+	tmp_path = f"{save_path}.{uuid.uuid4().hex}.part"
+	try:
+		with open(tmp_path, "wb") as out:
+			while True:
+				chunk = file.stream.read(CHUNK_SIZE)
+				if not chunk:
+					break
+				digest.update(chunk)
+				out.write(chunk)
+		os.replace(tmp_path, save_path)
+	finally:
+		if os.path.exists(tmp_path):
+			os.remove(tmp_path)
+	return digest.hexdigest()
+
+#==========================================================================
+
+def blob_path(sha256):
+	"""Path of the stored content with this hash"""
+	return os.path.join(BLOB_DIR, sha256[:2], sha256)
+
+#==========================================================================
+
+def store_upload(file, save_path):
+	"""
+	Saves an upload in the content-addressed store, where identical files 
+	are kept once, and makes save_path a hard link to the stored content.
+	Caches keyed by the file identity (device, inode) are thereby shared 
+	by every user who uploads the same file.
+
+	Returns:
+		str: sha256 of the content
+	"""
+	os.makedirs(BLOB_DIR, exist_ok=True)
+	tmp_path = os.path.join(BLOB_DIR, f"{uuid.uuid4().hex}.part")
+	sha256 = save_upload(file, tmp_path)
+
+	blob = blob_path(sha256)
+	os.makedirs(os.path.dirname(blob), exist_ok=True)
+	try:
+		os.link(tmp_path, blob)
+	except FileExistsError:
+		# Already stored, by an earlier or a concurrent upload
+		pass
+	finally:
+		os.remove(tmp_path)
+
+	link_file(blob, save_path)
+	return sha256
+
+#==========================================================================
+
+def link_file(source, path):
+	"""Makes path a hard link to source, replacing it atomically"""
+	link_path = f"{path}.{uuid.uuid4().hex}.link"
+	try:
+		os.link(source, link_path)
+	except OSError:
+		# No hard links on this file system: keep a private copy
+		shutil.copyfile(source, link_path)
+	os.replace(link_path, path)
+
+#==========================================================================
+
+def index_upload(save_path, sha256, build, suffix):
+	"""
+	Builds the sidecar index of a stored upload in the background, once per 
+	content (build(stored file, sidecar path)), and links it to save_path + suffix.
+
+	Returns:
+		Future of the indexing
+	"""
+	def run():
+		sidecar = blob_path(sha256) + suffix
+		try:
+			if not os.path.exists(sidecar):
+				build(blob_path(sha256), sidecar)
+			link_file(sidecar, save_path + suffix)
+		except Exception as e:
+			print("Indexing failed:", save_path, e)
+
+	return indexer.submit(run)